@@ -0,0 +1,88 @@
+# Микробенчмарк постобработки ObjectDetector: старый цикл по всем
+# 100 обнаружениям против векторизованного ObjectDetector.postprocess.
+# Запуск из корня репозитория: python -m benchmarks.postprocess_bench
+import sys
+import timeit
+
+import numpy as np
+
+from frame_analysis.object_detector import ObjectDetector
+
+CALLS = 20000
+DETECTIONS = 100  # столько рамок отдаёт сеть на один кадр
+IM_WIDTH = 640
+IM_HEIGHT = 360
+
+
+# Постобработка в том виде, в котором она была в ObjectDetector.process
+def legacy_postprocess(boxes, scores, classes, labels, classes_to_detect,
+                       confidence_level, im_width, im_height):
+    all_boxes = []
+    for i in range(boxes.shape[1]):
+        all_boxes.append((int(boxes[0, i, 1] * im_width),
+                          int(boxes[0, i, 0] * im_height),
+                          int(boxes[0, i, 3] * im_width),
+                          int(boxes[0, i, 2] * im_height)))
+
+    all_scores = scores[0].tolist()
+    all_classes = [int(x) for x in classes[0].tolist()]
+    all_labels = [labels[int(x) - 1] for x in all_classes]
+
+    ret_boxes = []
+    ret_scores = []
+    ret_labels = []
+    for i in range(len(all_boxes)):
+        if all_classes[i] in classes_to_detect and all_scores[i] > confidence_level:
+            ret_boxes.append(all_boxes[i])
+            ret_scores.append(all_scores[i])
+            ret_labels.append(all_labels[i])
+    return ret_boxes, ret_scores, ret_labels
+
+
+def fake_outputs(rng, labels_count):
+    ymin_xmin = rng.random((1, DETECTIONS, 2), dtype=np.float32) * 0.5
+    boxes = np.concatenate([ymin_xmin, ymin_xmin + 0.5], axis=2)
+    scores = np.sort(rng.random((1, DETECTIONS), dtype=np.float32))[:, ::-1].copy()
+    classes = rng.integers(1, labels_count + 1, (1, DETECTIONS)).astype(np.float32)
+    return boxes, scores, classes
+
+
+def main():
+    with open('classes_en.txt') as f:
+        labels = [s.strip() for s in f.readlines()]
+    classes_to_detect = [1, 17, 18]
+    confidence_level = 0.7
+
+    detector = ObjectDetector(model=None, labels=labels,
+                              classes_to_detect=classes_to_detect,
+                              confidence_level=confidence_level)
+    # чтобы что-то проходило фильтр, половина рамок - люди
+    boxes, scores, classes = fake_outputs(np.random.default_rng(0), len(labels))
+    classes[0, ::2] = 1
+
+    def run_legacy():
+        return legacy_postprocess(boxes, scores, classes, labels, classes_to_detect,
+                                  confidence_level, IM_WIDTH, IM_HEIGHT)
+
+    def run_vectorized():
+        detections = detector.postprocess(boxes[0], scores[0], classes[0], IM_WIDTH, IM_HEIGHT)
+        return (list(map(tuple, detections['box'].tolist())),
+                detections['score'].tolist(),
+                [labels[class_id - 1] for class_id in detections['class_id'].tolist()])
+
+    def run_structured():
+        return detector.postprocess(boxes[0], scores[0], classes[0], IM_WIDTH, IM_HEIGHT)
+
+    assert run_legacy() == run_vectorized(), 'результаты не совпадают'
+
+    print('{} calls, {} detections per call, {} kept'.format(CALLS, DETECTIONS, len(run_legacy()[0])))
+    for name, func in [('legacy loop', run_legacy),
+                       ('vectorized (lists)', run_vectorized),
+                       ('vectorized (structured)', run_structured)]:
+        best = min(timeit.repeat(func, number=CALLS, repeat=5))
+        print('{:<25} {:8.2f} us/call'.format(name, best / CALLS * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# Воспроизведение роликов через этапы анализа кадра без интерфейса:
+# подготовка кадра анализа, MotionDetector.process, ObjectDetector.process,
+# BorderDetector.are_rectangles_in_regions и VideoTool.get_frame (отрисовка).
+# Для каждого числа камер - задержки этапов (перцентили), FPS на камеру
+# и пиковая память процесса (в неё входят и ролики, загруженные в память).
+# ru_maxrss за время жизни процесса только растёт, поэтому каждое число камер
+# запускается в своём дочернем процессе и его пик пишется в свой прогон.
+# Результат - JSON, чтобы сравнивать прогоны
+# разных коммитов. Запуск из корня репозитория:
+#   python -m benchmarks.replay_bench                      # синтетические ролики
+#   python -m benchmarks.replay_bench --files               # ролики режима files
+#   python -m benchmarks.replay_bench --files a.mp4 b.mp4 --cameras 1 4 --output bench.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Thread, Barrier
+
+import cv2
+import numpy as np
+
+import cameramode
+from videotool import VideoTool
+from frame_analysis.border_detector import BorderDetector
+from frame_analysis.motion_detector import MotionDetector
+
+FILES_MODE_SOURCES = ['../cat.mp4', '../people.mp4']  # те же ролики, что в режиме files
+MODEL_PATH = 'nn_model/frozen_inference_graph.pb'
+LABELS_PATH = 'classes_en.txt'
+FRAMES = 300  # кадров на камеру в одном прогоне
+CAMERA_COUNTS = [1, 2, 4, 8]
+SOURCE_SIZE = (1280, 720)  # размер синтетических роликов
+SYNTHETIC_FRAMES = 60  # длина синтетического ролика, дальше он повторяется
+ANALYSIS_SIZE = (640, 360)
+DISPLAY_SIZE = (800, 450)
+DETECT_EVERY = 15  # поиск объектов на каждом таком кадре, как TRACKED_PROCESS_PERIOD
+WARMUP_FRAMES = 10  # первые кадры каждой камеры в статистику не идут
+SEED = 0
+ZONE = [(0.2, 0.2), (0.8, 0.2), (0.8, 0.8), (0.2, 0.8)]  # зона в долях кадра
+PERCENTILES = [50, 90, 99]
+
+
+# Детерминированный ролик: шумный фон и несколько движущихся прямоугольников
+def make_synthetic_clip(frames, size, seed=SEED, objects=3):
+    width, height = size
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (31, 31), 0)
+    positions = rng.random((objects, 2)) * (width * 0.7, height * 0.7)
+    speeds = (rng.random((objects, 2)) - 0.5) * (width / 50, height / 50)
+    sizes = (rng.random((objects, 2)) * 0.1 + 0.05) * (width, height)
+    clip = []
+    for i in range(frames):
+        frame = background.copy()
+        for j in range(objects):
+            x, y = positions[j]
+            w, h = sizes[j]
+            cv2.rectangle(frame, (int(x), int(y)), (int(x + w), int(y + h)),
+                          (255, 255 - 60 * j, 60 * j), -1)
+        positions += speeds
+        bounce = (positions < 0) | (positions + sizes > (width, height))
+        speeds[bounce] *= -1
+        clip.append(frame)
+    return clip
+
+
+# Кадры ролика целиком в память, чтобы декодирование не смешивалось
+# с этапами анализа. Время декодирования кадра - отдельный этап
+def load_clip(path, frames):
+    video = cv2.VideoCapture(path)
+    if not video.isOpened():
+        raise IOError('Cannot open {}'.format(path))
+    clip = []
+    decode_ms = []
+    while len(clip) < frames:
+        time_start = time.perf_counter()
+        ret, frame = video.read()
+        if not ret or frame is None:
+            break
+        decode_ms.append((time.perf_counter() - time_start) * 1000)
+        clip.append(frame)
+    video.release()
+    if len(clip) == 0:
+        raise IOError('No frames in {}'.format(path))
+    return clip, decode_ms
+
+
+def create_object_detector(model_path):
+    if model_path is None or not os.path.exists(model_path):
+        return None, None
+    from frame_analysis.model_registry import ModelRegistry
+    from frame_analysis.object_detector import ObjectDetector
+    with open(LABELS_PATH) as f:
+        labels = [s.strip() for s in f.readlines()]
+    registry = ModelRegistry()
+    detector = ObjectDetector(model=registry.acquire(model_path), labels=labels,
+                              classes_to_detect=[1, 17, 18], confidence_level=0.7)
+    return detector, registry
+
+
+# Одна камера: свои VideoTool, детектор движения и зона, как в приложении
+class ReplayCamera(Thread):
+    def __init__(self, index, clip, frames, object_detector, barrier, args):
+        super().__init__(name='ReplayCamera' + str(index))
+        self.clip = clip
+        self.offset = index * 7 % len(clip)  # камеры с одним роликом не синхронны
+        self.frames = frames
+        self.object_detector = object_detector
+        self.barrier = barrier
+        self.analysis_size = tuple(args.analysis_size)
+        self.display_size = tuple(args.display_size)
+        self.detect_every = args.detect_every
+
+        self.vtool = VideoTool(src=None)
+        self.vtool.set_display_format(is_rgb=False)
+        self.vtool.motion_detector = MotionDetector()
+        self.vtool.border_detector = BorderDetector()
+        width, height = self.analysis_size
+        self.vtool.border_detector.set_points([(x * width, y * height) for x, y in ZONE],
+                                              self.analysis_size)
+        self.vtool.is_borders_mode = True
+        self.vtool.mode = cameramode.DETECT_MOTION
+
+        self.stages = {'prepare': [], 'motion': [], 'objects': [], 'zone': [], 'render': [], 'frame': []}
+        self.elapsed_sec = 0
+
+    def run(self):
+        self.barrier.wait()
+        time_start = time.perf_counter()
+        for i in range(WARMUP_FRAMES + self.frames):
+            if i == WARMUP_FRAMES:
+                for values in self.stages.values():
+                    values.clear()
+                time_start = time.perf_counter()
+            self.process(self.clip[(self.offset + i) % len(self.clip)], i)
+        self.elapsed_sec = time.perf_counter() - time_start
+
+    def process(self, original, i):
+        vtool = self.vtool
+        t0 = time.perf_counter()
+        frame = vtool.prepare_frame(original, *self.analysis_size)
+        t1 = time.perf_counter()
+        boxes = vtool.motion_detector.process(frame)
+        t2 = time.perf_counter()
+        if self.object_detector is not None and i % self.detect_every == 0:
+            self.object_detector.process(frame)
+            t3 = time.perf_counter()
+            self.stages['objects'].append((t3 - t2) * 1000)
+        else:
+            t3 = time.perf_counter()
+        vtool.border_detector.are_rectangles_in_regions(boxes, self.analysis_size)
+        t4 = time.perf_counter()
+        vtool.set_motion_detections(boxes, self.analysis_size)
+        vtool.get_frame(original, *self.display_size, bgr_to_rgb=False, analyze=False)
+        t5 = time.perf_counter()
+        self.stages['prepare'].append((t1 - t0) * 1000)
+        self.stages['motion'].append((t2 - t1) * 1000)
+        self.stages['zone'].append((t4 - t3) * 1000)
+        self.stages['render'].append((t5 - t4) * 1000)
+        self.stages['frame'].append((t5 - t0) * 1000)
+
+
+def summarize(values_ms):
+    if len(values_ms) == 0:
+        return None
+    values = np.array(values_ms)
+    summary = {'count': len(values), 'mean_ms': round(float(values.mean()), 3),
+               'max_ms': round(float(values.max()), 3)}
+    for p in PERCENTILES:
+        summary['p{}_ms'.format(p)] = round(float(np.percentile(values, p)), 3)
+    return summary
+
+
+# Пиковый резидентный объём процесса в МБ (None, если узнать нельзя)
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдаёт КБ, macOS - байты
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return round(getattr(info, 'peak_wset', info.rss) / 1024 ** 2, 1)
+
+
+def run(clips, count, object_detector, args):
+    barrier = Barrier(count)
+    cameras = [ReplayCamera(i, clips[i % len(clips)], args.frames, object_detector, barrier, args)
+               for i in range(count)]
+    time_start = time.perf_counter()
+    for camera in cameras:
+        camera.start()
+    for camera in cameras:
+        camera.join()
+    wall_sec = time.perf_counter() - time_start
+    stages = {}
+    for name in cameras[0].stages:
+        stages[name] = summarize([v for camera in cameras for v in camera.stages[name]])
+    fps = [args.frames / camera.elapsed_sec for camera in cameras]
+    return {'cameras': count,
+            'wall_sec': round(wall_sec, 3),
+            'fps_per_camera': round(float(np.mean(fps)), 2),
+            'fps_per_camera_min': round(float(np.min(fps)), 2),
+            'total_fps': round(float(np.sum(fps)), 2),
+            'stages': stages}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay benchmark of the frame analysis pipeline')
+    parser.add_argument('--files', nargs='*', default=None,
+                        help='video files to replay; without paths - the files mode clips')
+    parser.add_argument('--frames', type=int, default=FRAMES, help='frames per camera')
+    parser.add_argument('--cameras', type=int, nargs='+', default=CAMERA_COUNTS,
+                        help='camera counts to run')
+    parser.add_argument('--analysis-size', type=int, nargs=2, default=ANALYSIS_SIZE)
+    parser.add_argument('--display-size', type=int, nargs=2, default=DISPLAY_SIZE)
+    parser.add_argument('--detect-every', type=int, default=DETECT_EVERY)
+    parser.add_argument('--model', default=MODEL_PATH,
+                        help='frozen graph for ObjectDetector; the stage is skipped if it is missing')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--in-process', action='store_true',
+                        help='run all camera counts in this process (used for the child runs)')
+    return parser.parse_args()
+
+
+# Каждое число камер - в отдельном процессе с --in-process. Отчёт берётся
+# из первого прогона, в runs - прогоны всех процессов с пиком памяти каждого
+def run_children(args):
+    report = None
+    runs = []
+    for count in args.cameras:
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        command = [sys.executable, '-m', 'benchmarks.replay_bench', '--in-process',
+                   '--cameras', str(count), '--frames', str(args.frames),
+                   '--analysis-size', *map(str, args.analysis_size),
+                   '--display-size', *map(str, args.display_size),
+                   '--detect-every', str(args.detect_every),
+                   '--model', args.model, '--output', path]
+        if args.files is not None:
+            command += ['--files'] + args.files
+        try:
+            code = subprocess.call(command)
+            if code != 0:
+                print('{} cameras: benchmark process failed with code {}'.format(count, code),
+                      file=sys.stderr)
+                return code
+            with open(path) as f:
+                child_report = json.load(f)
+        finally:
+            os.remove(path)
+        result = child_report['runs'][0]
+        result['peak_rss_mb'] = child_report['peak_rss_mb']
+        runs.append(result)
+        if report is None:
+            report = child_report
+    del report['peak_rss_mb']
+    report['runs'] = runs
+    return write_report(report, args.output)
+
+
+def write_report(report, output):
+    text = json.dumps(report, indent=2)
+    if output is None:
+        print(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    return 0
+
+
+def main():
+    args = parse_args()
+    if not args.in_process:
+        return run_children(args)
+    cv2.setRNGSeed(SEED)
+    decode_ms = []
+    if args.files is None:
+        sources = ['synthetic']
+        clips = [make_synthetic_clip(min(args.frames, SYNTHETIC_FRAMES), SOURCE_SIZE, seed=SEED + i)
+                 for i in range(2)]
+    else:
+        sources = args.files if len(args.files) > 0 else FILES_MODE_SOURCES
+        clips = []
+        for path in sources:
+            clip, clip_decode_ms = load_clip(path, args.frames)
+            clips.append(clip)
+            decode_ms.extend(clip_decode_ms)
+
+    object_detector, registry = create_object_detector(args.model)
+    if object_detector is None:
+        print('ObjectDetector stage skipped: no model at {}'.format(args.model), file=sys.stderr)
+
+    runs = []
+    for count in args.cameras:
+        result = run(clips, count, object_detector, args)
+        print('{} cameras: {} FPS per camera, frame p50 {} ms'.format(
+            count, result['fps_per_camera'], result['stages']['frame']['p50_ms']), file=sys.stderr)
+        runs.append(result)
+    if object_detector is not None:
+        object_detector.close()
+        registry.close()
+
+    report = {'commit': get_commit(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'platform': {'python': platform.python_version(),
+                           'system': platform.platform(),
+                           'cpu_count': os.cpu_count(),
+                           'opencv': cv2.__version__,
+                           'numpy': np.__version__},
+              'params': {'sources': sources,
+                         'clip_frames': [len(clip) for clip in clips],
+                         'clip_size': [clips[0][0].shape[1], clips[0][0].shape[0]],
+                         'frames': args.frames,
+                         'warmup_frames': WARMUP_FRAMES,
+                         'analysis_size': list(args.analysis_size),
+                         'display_size': list(args.display_size),
+                         'detect_every': args.detect_every,
+                         'object_detector': object_detector is not None},
+              'decode': summarize(decode_ms),
+              'runs': runs,
+              'peak_rss_mb': get_peak_rss_mb()}
+    return write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
 ORIGINAL = 0
 DETECT_OBJECTS = 1
 DETECT_MOTION = 2
+DETECT_MOTION_OBJECTS = 3  # объекты ищутся только там, где есть движение
@@ -0,0 +1,341 @@
+import multiprocessing as mp
+import queue
+import time
+import traceback
+from multiprocessing import shared_memory
+from threading import Thread, Event
+
+import cv2
+import numpy as np
+
+import cameramode
+from capturehub import SharedCapture, STATE_CONNECTING
+from videotool import VideoTool
+from frame_analysis.border_detector import BorderDetector
+from frame_analysis.motion_detector import MotionDetector
+from frame_analysis.object_detector import ObjectDetector
+from frame_analysis.model_registry import ModelRegistry
+
+FRAME_RING_SLOTS = 3  # сколько последних кадров хранит кольцо в общей памяти
+MAX_RESULT_BOXES = 64  # больше рамок за один результат не передаётся
+READY_TIMEOUT_SEC = 60  # сколько ждать, пока процесс камеры откроет поток
+
+
+# Несколько numpy-массивов в одном блоке общей памяти.
+# layout - список (имя, форма, dtype), порядок одинаков у создателя и читателя
+class SharedArrays:
+    def __init__(self, layout, name=None):
+        sizes = [int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in layout]
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(1, sum(sizes)))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.arrays = {}
+        offset = 0
+        for (key, shape, dtype), size in zip(layout, sizes):
+            self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            offset += size
+        if name is None:
+            for array in self.arrays.values():
+                array.fill(0)
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def close(self):
+        self.arrays = {}
+        self.shm.close()
+
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# Управление процессом камеры со стороны интерфейса
+CONTROL_STOP = 0
+CONTROL_MODE = 1
+CONTROL_STATE = 2  # состояние источника, пишет процесс камеры
+CONTROL_LAYOUT = [('control', (3,), np.int64)]
+
+
+# Кольцо последних кадров. Номер кадра в слоте сбрасывается в -1 на время
+# записи, поэтому читатель может проверить, что слот не перезаписали,
+# пока он копировал кадр
+def frame_ring_layout(shape, slots):
+    return [('latest', (1,), np.int64),
+            ('slot_seq', (slots,), np.int64),
+            ('frames', (slots,) + tuple(shape), np.uint8)]
+
+
+# Последний результат анализа: счётчики начала и конца записи
+# совпадают, только когда результат записан целиком
+RESULT_OBJECTS = 0
+RESULT_MOTION = 1
+
+
+def results_layout(max_boxes):
+    return [('seq', (2,), np.int64),
+            ('kind', (1,), np.int64),
+            ('count', (1,), np.int64),
+            ('boxes', (max_boxes, 4), np.int32),
+            ('class_ids', (max_boxes,), np.int32)]
+
+
+# Размер кольца задаётся первым кадром. Если поток после переподключения
+# пришёл в другом разрешении, кадры приводятся к размеру кольца: интерфейс
+# уже отобразил общую память этого размера
+class FrameRingWriter:
+    def __init__(self, shape, slots=FRAME_RING_SLOTS, name='FrameRing'):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.name = name
+        self.arrays = SharedArrays(frame_ring_layout(self.shape, slots))
+        self.seq = 0
+        self.other_shape = None  # последний размер кадра, не совпавший с кольцом
+
+    def write(self, frame):
+        if frame.shape != self.shape:
+            if frame.shape != self.other_shape:
+                self.other_shape = frame.shape
+                print('{}: frame size changed from {} to {}, {}'.format(
+                    self.name, self.shape, frame.shape,
+                    'frames are resized' if frame.shape[2:] == self.shape[2:] else 'frames are skipped'))
+            if frame.shape[2:] != self.shape[2:]:
+                return False
+            frame = cv2.resize(frame, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA)
+        else:
+            self.other_shape = None
+        self.seq += 1
+        i = self.seq % self.slots
+        self.arrays['slot_seq'][i] = -1
+        self.arrays['frames'][i][...] = frame
+        self.arrays['slot_seq'][i] = self.seq
+        self.arrays['latest'][0] = self.seq
+        return True
+
+
+class ResultsWriter:
+    def __init__(self, max_boxes=MAX_RESULT_BOXES):
+        self.max_boxes = max_boxes
+        self.arrays = SharedArrays(results_layout(max_boxes))
+
+    # class_ids = None - области движения
+    def write(self, boxes, class_ids):
+        count = min(len(boxes), self.max_boxes)
+        seq = self.arrays['seq']
+        seq[0] += 1
+        if count > 0:
+            self.arrays['boxes'][:count] = np.array(boxes[:count], dtype=np.int32).reshape(-1, 4)
+        if class_ids is None:
+            self.arrays['kind'][0] = RESULT_MOTION
+        else:
+            self.arrays['kind'][0] = RESULT_OBJECTS
+            self.arrays['class_ids'][:count] = class_ids[:count]
+        self.arrays['count'][0] = count
+        seq[1] = seq[0]
+
+
+# Точка входа процесса камеры: захват и анализ одного видеопотока.
+# Кадры и результаты уходят в общую память, в очередь - только их описание
+def run_camera(name, src, options, control_name, meta_queue, frame_ready):
+    control_arrays = SharedArrays(CONTROL_LAYOUT, control_name)
+    control = control_arrays['control']
+    # переподключение при обрывах - как в CaptureHub, внутри процесса камеры
+    source = SharedCapture(src, name + 'Capture')
+    source.add_state_listener(lambda state: control.__setitem__(CONTROL_STATE, state))
+    control[CONTROL_STATE] = source.state
+    vtool = VideoTool(src=None)
+    vtool.process_period = options['process_period']
+    vtool.analysis_size = options['analysis_size']
+    vtool.motion_detector = MotionDetector()
+    vtool.border_detector = BorderDetector()
+    model_registry = None
+    if options.get('model_path'):
+        model_registry = ModelRegistry(intra_op_threads=options.get('intra_op_threads', 0),
+                                       inter_op_threads=options.get('inter_op_threads', 0))
+        vtool.object_detector = ObjectDetector(model=model_registry.acquire(options['model_path']),
+                                               labels=options['labels'],
+                                               classes_to_detect=options['classes_to_detect'],
+                                               confidence_level=options['confidence_level'])
+    label_ids = {label: i + 1 for i, label in enumerate(options.get('labels', []))}
+
+    frames = None
+    results = None
+    stop_event = Event()
+    ring_slot = source.subscribe()  # все кадры - в общую память для показа
+    frame_slot = source.subscribe()  # последний кадр - на анализ
+
+    def write_ring(last_seq):
+        try:
+            while not stop_event.is_set() and not control[CONTROL_STOP]:
+                last_seq, frame = ring_slot.get(last_seq, timeout=0.1)
+                if frame is not None and frames.write(frame):
+                    frame_ready.release()
+                elif ring_slot.is_closed:
+                    break
+        except:
+            print('{} - unexpected error: {}'.format(name, traceback.format_exc()))
+
+    try:
+        source.start()
+        # первый кадр нужен, чтобы узнать размер кольца кадров
+        seq, frame = ring_slot.get(0, timeout=READY_TIMEOUT_SEC)
+        if frame is None:
+            print('{}: no frames from {}'.format(name, src))
+            meta_queue.put(None)
+            return
+        vtool.set_sources(source)
+        frames = FrameRingWriter(frame.shape, name=name)
+        results = ResultsWriter()
+        meta_queue.put({'frames': frames.arrays.name,
+                        'shape': frame.shape,
+                        'slots': frames.slots,
+                        'results': results.arrays.name,
+                        'max_boxes': results.max_boxes,
+                        'fps': vtool.fps})
+        reader = Thread(target=write_ring, args=[seq])
+        reader.start()
+
+        analysis_period = 1 / options['analysis_fps']
+        last_seq = 0
+        published_seq = vtool.result_seq
+        next_time = time.monotonic()
+        while not control[CONTROL_STOP]:
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            seq, original = frame_slot.get(last_seq, timeout=0.1)
+            if original is None:
+                if frame_slot.is_closed:
+                    break
+                continue
+            last_seq = seq
+            next_time = time.monotonic() + analysis_period
+
+            mode = int(control[CONTROL_MODE])
+            if mode == cameramode.ORIGINAL or \
+                    (vtool.object_detector is None and mode != cameramode.DETECT_MOTION):
+                continue
+            vtool.mode = mode
+            width, height = vtool.get_analysis_size(original.shape[1], original.shape[0])
+            vtool.analyze(vtool.prepare_frame(original, width, height), mode)
+            if vtool.result_seq != published_seq:
+                published_seq = vtool.result_seq
+                boxes, labels = vtool.last_result
+                class_ids = None if labels is None else [label_ids.get(l, 0) for l in labels]
+                results.write(boxes, class_ids)
+        stop_event.set()
+        reader.join()
+    except:
+        print('{} - unexpected error: {}'.format(name, traceback.format_exc()))
+    finally:
+        stop_event.set()
+        source.stop()
+        vtool.close()
+        if vtool.object_detector is not None:
+            vtool.object_detector.close()
+        if model_registry is not None:
+            model_registry.close()
+        # блоки кадров и результатов удаляет интерфейсный процесс
+        if frames is not None:
+            frames.arrays.close()
+        if results is not None:
+            results.arrays.close()
+        control = None
+        control_arrays.close()
+        print('{}: done!'.format(name))
+
+
+# Процесс камеры со стороны интерфейса: запуск, чтение кадров
+# и результатов из общей памяти, остановка
+class CameraProcess:
+    def __init__(self, name, src, options):
+        self.name = name
+        ctx = mp.get_context('spawn')  # fork после загрузки TF и Qt небезопасен
+        self.control_arrays = SharedArrays(CONTROL_LAYOUT)
+        self.control = self.control_arrays['control']
+        self.control[CONTROL_STATE] = STATE_CONNECTING
+        self.meta_queue = ctx.Queue()
+        self.frame_ready = ctx.Semaphore(0)
+        self.process = ctx.Process(target=run_camera, name=name, daemon=True,
+                                   args=(name, src, options, self.control_arrays.name,
+                                         self.meta_queue, self.frame_ready))
+        self.frames = None
+        self.results = None
+        self.meta = None
+
+    def start(self):
+        self.process.start()
+
+    # Ждёт, пока процесс откроет поток и создаст общую память
+    def wait_ready(self, timeout=READY_TIMEOUT_SEC):
+        try:
+            self.meta = self.meta_queue.get(timeout=timeout)
+        except queue.Empty:
+            self.meta = None
+        if self.meta is None:
+            return False
+        self.frames = SharedArrays(frame_ring_layout(self.meta['shape'], self.meta['slots']),
+                                   self.meta['frames'])
+        self.results = SharedArrays(results_layout(self.meta['max_boxes']),
+                                    self.meta['results'])
+        return True
+
+    def get_state(self):
+        return int(self.control[CONTROL_STATE])
+
+    def set_analysis(self, mode):
+        self.control[CONTROL_MODE] = mode
+
+    # Возвращает (seq, копия кадра) или (last_seq, None), если нового кадра нет
+    def read_frame(self, last_seq, timeout):
+        self.frame_ready.acquire(timeout=timeout)
+        seq = int(self.frames['latest'][0])
+        if seq <= last_seq:
+            return last_seq, None
+        i = seq % self.meta['slots']
+        if self.frames['slot_seq'][i] != seq:
+            return last_seq, None
+        frame = self.frames['frames'][i].copy()
+        if self.frames['slot_seq'][i] != seq:
+            return last_seq, None  # слот перезаписали во время копирования
+        return seq, frame
+
+    # Возвращает (seq, рамки, номера классов или None) или None, если нового результата нет
+    def read_result(self, last_seq):
+        seq = self.results['seq']
+        end = int(seq[1])
+        if end <= last_seq:
+            return None
+        count = int(self.results['count'][0])
+        kind = int(self.results['kind'][0])
+        boxes = list(map(tuple, self.results['boxes'][:count].tolist()))
+        class_ids = self.results['class_ids'][:count].tolist()
+        if int(seq[0]) != end:
+            return None  # результат записывается прямо сейчас
+        if kind == RESULT_MOTION:
+            class_ids = None
+        return end, boxes, class_ids
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        self.control[CONTROL_STOP] = 1
+        if self.process.pid is not None:
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        for arrays in (self.frames, self.results):
+            if arrays is not None:
+                arrays.close()
+                arrays.unlink()
+        self.frames = None
+        self.results = None
+        self.control = None
+        self.control_arrays.close()
+        self.control_arrays.unlink()
@@ -0,0 +1,338 @@
+import time
+import traceback
+from threading import Thread, Lock, Event
+
+import cv2
+
+import metrics
+from frameslot import FrameSlot, FrameQueue
+
+POLICY_LATEST = 'latest'  # подписчику нужен только последний кадр
+POLICY_QUEUE = 'queue'  # подписчику нужны кадры по порядку (до maxlen штук)
+IDLE_WAIT_SEC = 0.05  # пауза, пока у источника нет подписчиков или нет кадров
+MAX_FAILED_GRABS = 10  # столько неудачных grab подряд - и источник переподключается
+STALL_TIMEOUT_SEC = 5  # без кадров дольше - поток считается зависшим
+WATCHDOG_PERIOD_SEC = 1
+RECONNECT_MIN_SEC = 0.5  # первая пауза перед повторным подключением,
+RECONNECT_MAX_SEC = 30   # дальше она удваивается до этого предела
+CAPTURE_TIMEOUT_MSEC = 5000  # таймауты открытия и чтения потока
+
+# Состояния источника
+STATE_CONNECTING = 0
+STATE_LIVE = 1
+STATE_RECONNECTING = 2
+
+
+# С таймаутами (OpenCV 4.5+) grab на оборванном RTSP не висит бесконечно
+def open_capture(src):
+    if hasattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC'):
+        return cv2.VideoCapture(src, cv2.CAP_ANY,
+                                [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, CAPTURE_TIMEOUT_MSEC,
+                                 cv2.CAP_PROP_READ_TIMEOUT_MSEC, CAPTURE_TIMEOUT_MSEC])
+    return cv2.VideoCapture(src)
+
+
+# Худшее из состояний нескольких источников (например, основного и дополнительного потока)
+def combined_state(sources):
+    states = [source.state for source in sources if source is not None]
+    if STATE_RECONNECTING in states:
+        return STATE_RECONNECTING
+    if STATE_CONNECTING in states:
+        return STATE_CONNECTING
+    return STATE_LIVE
+
+
+# Один физический источник: открывается и декодируется один раз,
+# кадр раздаётся всем подписчикам, каждый со своей политикой потерь.
+# Оборванный или зависший поток переподключается в фоне, подписчики
+# при этом остаются подписанными и просто какое-то время не получают кадров
+class SharedCapture(Thread):
+    def __init__(self, src, name):
+        super().__init__(name=name, daemon=True)
+        self.src = src
+        self.fps = 0
+        self.frame_w = 0
+        self.frame_h = 0
+        self.state = STATE_CONNECTING
+        self.state_listeners = []  # func(state), вызываются из потоков захвата
+        self.video = open_capture(src)
+        if self.video.isOpened():
+            self.update_stream_info()
+        self.failed_grabs = 0
+        self.last_grab_time = time.monotonic()
+        self.is_reconnect_requested = False
+        self.retry_delay = RECONNECT_MIN_SEC
+        self.outage_start = None  # когда пропали кадры, для времени восстановления
+        self.last_recovery_sec = None
+        self.reconnects = 0
+        self.subscribers = []
+        self.requests = {}  # подписчик -> сколько ещё кадров декодировать для него
+        self.lock = Lock()
+        self.stop_event = Event()
+
+        self.grabbed = 0  # кадры, вычитанные из потока
+        self.decoded = 0  # кадры, которые пришлось декодировать
+        self.decode_time = metrics.REGISTRY.histogram('decode_seconds', 'Time to decode a grabbed frame',
+                                                      source=name)
+
+    def update_stream_info(self):
+        fps = self.video.get(cv2.CAP_PROP_FPS)
+        frame_w = self.video.get(cv2.CAP_PROP_FRAME_WIDTH)
+        frame_h = self.video.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        if fps > 0:
+            self.fps = fps
+        if frame_w > 0 and frame_h > 0:
+            self.frame_w = frame_w
+            self.frame_h = frame_h
+
+    def add_state_listener(self, func):
+        self.state_listeners.append(func)
+
+    def remove_state_listener(self, func):
+        if func in self.state_listeners:
+            self.state_listeners.remove(func)
+
+    def has_subscribers(self):
+        with self.lock:
+            return len(self.subscribers) > 0
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        for func in list(self.state_listeners):
+            func(state)
+
+    # Возвращает ячейку (FrameSlot или FrameQueue), в которую будут приходить кадры.
+    # active=False - кадры декодируются для подписчика, только пока он сам
+    # не включит is_active или не запросит их через request.
+    # name - кто читает кадры, метка подписчика в метриках
+    def subscribe(self, policy=POLICY_LATEST, maxlen=1, active=True, name='subscriber'):
+        if policy == POLICY_LATEST:
+            slot = FrameSlot(name)
+        elif policy == POLICY_QUEUE:
+            slot = FrameQueue(maxlen, name)
+        else:
+            raise ValueError('Unknown drop policy: {}'.format(policy))
+        slot.is_active = active
+        with self.lock:
+            self.subscribers.append(slot)
+        return slot
+
+    def unsubscribe(self, slot):
+        with self.lock:
+            if slot in self.subscribers:
+                self.subscribers.remove(slot)
+            self.requests.pop(slot, None)
+        slot.close()
+
+    # Декодировать для неактивного подписчика следующие count кадров,
+    # count = 0 отменяет запрос
+    def request(self, slot, count):
+        with self.lock:
+            if count > 0:
+                self.requests[slot] = count
+            else:
+                self.requests.pop(slot, None)
+
+    # Подписчики, которым нужен текущий кадр; запросы уменьшаются на один кадр
+    def take_consumers(self):
+        with self.lock:
+            consumers = []
+            for slot in self.subscribers:
+                count = self.requests.get(slot, 0)
+                if count > 0:
+                    if count == 1:
+                        del self.requests[slot]
+                    else:
+                        self.requests[slot] = count - 1
+                    consumers.append(slot)
+                elif slot.is_active:
+                    consumers.append(slot)
+            return consumers
+
+    def run(self):
+        print('{}: let\'s read {}!'.format(self.getName(), self.src))
+        try:
+            while not self.stop_event.is_set():
+                if not self.video.isOpened() or self.is_reconnect_requested:
+                    self.reconnect()
+                    continue
+                with self.lock:
+                    has_subscribers = len(self.subscribers) > 0
+                if not has_subscribers:
+                    self.last_grab_time = time.monotonic()  # простой - не зависание
+                    self.stop_event.wait(IDLE_WAIT_SEC)
+                    continue
+                # поток вычитывается всегда, чтобы не отставал,
+                # а декодируется, только если кадр кому-то нужен
+                if not self.video.grab():
+                    self.failed_grabs += 1
+                    if self.failed_grabs >= MAX_FAILED_GRABS:
+                        self.is_reconnect_requested = True
+                    else:
+                        self.stop_event.wait(IDLE_WAIT_SEC)
+                    continue
+                self.on_grabbed()
+                consumers = self.take_consumers()
+                if len(consumers) == 0:
+                    continue
+                time_start = time.perf_counter()
+                ret, frame = self.video.retrieve()
+                if not ret or frame is None:
+                    continue
+                self.decode_time.observe_since(time_start)
+                self.decoded += 1
+                for slot in consumers:
+                    slot.put(frame)
+        except:
+            print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
+        finally:
+            with self.lock:
+                subscribers = list(self.subscribers)
+            for slot in subscribers:
+                slot.close()
+            self.video.release()
+        print('{}: done! Frames: {}'.format(self.getName(), self.get_stats()))
+
+    def on_grabbed(self):
+        self.grabbed += 1
+        self.failed_grabs = 0
+        self.last_grab_time = time.monotonic()
+        if self.state != STATE_LIVE:
+            if self.outage_start is not None:
+                self.last_recovery_sec = self.last_grab_time - self.outage_start
+                print('{}: {} is back in {:.1f} sec'.format(self.getName(), self.src,
+                                                            self.last_recovery_sec))
+            self.outage_start = None
+            self.retry_delay = RECONNECT_MIN_SEC
+            self.set_state(STATE_LIVE)
+
+    # Переоткрывает поток с экспоненциально растущими паузами между попытками.
+    # Пауза сбрасывается только после первого полученного кадра, поэтому
+    # поток, который открывается, но не отдаёт кадров, тоже не дёргается часто
+    def reconnect(self):
+        if self.state == STATE_LIVE:
+            self.set_state(STATE_RECONNECTING)
+            print('{}: {} is lost, reconnecting...'.format(self.getName(), self.src))
+        if self.outage_start is None:
+            self.outage_start = self.last_grab_time
+        if self.stop_event.wait(self.retry_delay):
+            return
+        self.retry_delay = min(RECONNECT_MAX_SEC, self.retry_delay * 2)
+        self.is_reconnect_requested = False
+        self.failed_grabs = 0
+        self.reconnects += 1
+        self.video.release()
+        self.video = open_capture(self.src)
+        if self.video.isOpened():
+            self.update_stream_info()
+            self.last_grab_time = time.monotonic()
+        else:
+            print('{}: {} is unavailable, next try in {:.1f} sec'.format(self.getName(), self.src,
+                                                                         self.retry_delay))
+
+    # Вызывается сторожевым потоком CaptureHub: grab без таймаута чтения
+    # может зависнуть, тогда хотя бы показываем, что источник переподключается
+    def check_stall(self, now):
+        if self.state == STATE_LIVE and now - self.last_grab_time > STALL_TIMEOUT_SEC:
+            print('{}: no frames from {} for {:.1f} sec'.format(self.getName(), self.src,
+                                                                now - self.last_grab_time))
+            self.outage_start = self.last_grab_time
+            self.is_reconnect_requested = True
+            self.set_state(STATE_RECONNECTING)
+
+    def get_stats(self):
+        return {'grabbed': self.grabbed,
+                'decoded': self.decoded,
+                'reconnects': self.reconnects,
+                'last_recovery_sec': self.last_recovery_sec}
+
+    # Счётчики источника и его подписчиков для metrics.REGISTRY
+    def collect(self):
+        name = self.getName()
+        samples = [('capture_frames_total', 'counter', 'Frames read from the stream',
+                    {'source': name, 'kind': 'grabbed'}, self.grabbed),
+                   ('capture_frames_total', 'counter', 'Frames read from the stream',
+                    {'source': name, 'kind': 'decoded'}, self.decoded),
+                   ('capture_reconnects_total', 'counter', 'Stream reconnect attempts',
+                    {'source': name}, self.reconnects),
+                   ('capture_live', 'gauge', '1 if the stream delivers frames',
+                    {'source': name}, 1 if self.state == STATE_LIVE else 0)]
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for slot in subscribers:
+            stats = slot.get_stats()
+            labels = {'source': name, 'subscriber': slot.name}
+            for kind in ('received', 'dropped'):
+                samples.append(('subscriber_frames_total', 'counter',
+                                'Frames passed to a subscriber (dropped - overwritten before read)',
+                                dict(labels, kind=kind), stats[kind]))
+            samples.append(('subscriber_empty_waits_total', 'counter',
+                            'Subscriber waits that timed out without a new frame',
+                            labels, stats['empty_waits']))
+            samples.append(('subscriber_queued_frames', 'gauge', 'Frames waiting for a subscriber',
+                            labels, stats['queued']))
+        return samples
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+# Все источники видео приложения: один SharedCapture на каждый src,
+# сколько бы потребителей (показ, охрана, запись) его ни читало
+class CaptureHub:
+    def __init__(self):
+        self.sources = {}
+        self.created = 0  # для имён потоков: источники могут закрываться по одному
+        self.lock = Lock()
+        self.stop_event = Event()
+        metrics.REGISTRY.add_collector(self.collect)
+        self.watchdog = Thread(target=self.watch, name='CaptureWatchdog', daemon=True)
+        self.watchdog.start()
+
+    def collect(self):
+        with self.lock:
+            sources = list(self.sources.values())
+        return [sample for source in sources for sample in source.collect()]
+
+    # Каждый источник проверяется отдельно, остальные камеры это не затрагивает
+    def watch(self):
+        while not self.stop_event.wait(WATCHDOG_PERIOD_SEC):
+            with self.lock:
+                sources = list(self.sources.values())
+            now = time.monotonic()
+            for source in sources:
+                source.check_stall(now)
+
+    def get_source(self, src):
+        with self.lock:
+            source = self.sources.get(src)
+            if source is None:
+                source = SharedCapture(src, 'Capture' + str(self.created))
+                self.created += 1
+                source.start()
+                self.sources[src] = source
+            return source
+
+    # Закрывает источник, если его больше никто не читает
+    # (например, камеру убрали из конфигурации)
+    def release(self, source):
+        with self.lock:
+            if source.has_subscribers() or self.sources.get(source.src) is not source:
+                return
+            del self.sources[source.src]
+        source.stop()
+        metrics.REGISTRY.remove(source.decode_time)
+
+    def close(self):
+        metrics.REGISTRY.remove_collector(self.collect)
+        self.stop_event.set()
+        self.watchdog.join()
+        with self.lock:
+            sources = list(self.sources.values())
+            self.sources = {}
+        for source in sources:
+            source.stop()
@@ -0,0 +1,127 @@
+import copy
+import json
+
+import cameramode
+
+# Настройки по умолчанию. В файле конфигурации (JSON) достаточно указать
+# камеры и то, что отличается от значений здесь
+DEFAULTS = {
+    'model_path': 'nn_model/frozen_inference_graph.pb',
+    'labels_path': 'classes_en.txt',
+    'classes_to_detect': [1, 17, 18],  # номер класса = номер строки в labels_path
+    'confidence_level': 0.7,
+    'inference_max_batch': None,  # кадров в одном sess.run, None - по числу работающих
+                                  # камер плюс охрана, пересчитывается при добавлении камер
+    'inference_max_wait_ms': 15,
+    'detection_max_per_sec': 10,
+    'detection_cpu_budget': 2.0,
+    'tf_intra_op_threads': 0,
+    'tf_inter_op_threads': 0,
+    'analysis_fps': 15,
+    'events_db': 'events.db',
+    'recordings_dir': 'recordings',
+    'record': {
+        'preroll_sec': 5,
+        'preroll_max_mb': 16,
+        'tail_sec': 5,
+        'fps': 10,
+        'segment_sec': 300,
+        'quota_gb': 20,
+    },
+    'security': None,  # проверка охранника, см. SECURITY_DEFAULTS
+    'metrics_port': None,  # порт /metrics в формате Prometheus, None - не отдавать
+    'metrics_host': '127.0.0.1',
+    'metrics_overlay': False,  # время этапов поверх видео каждой камеры
+    'cameras': [],
+}
+
+CAMERA_DEFAULTS = {
+    'id': None,  # номер камеры в журнале, по умолчанию - порядковый с 1
+    'name': None,  # подпись в окне, по умолчанию 'Камера №<id>'
+    'source': None,  # адрес потока, файл или номер устройства
+    'substream': None,  # поток низкого разрешения для анализа
+    'mode': 'motion_objects',
+    # None - общие значения из DEFAULTS
+    'classes_to_detect': None,
+    'confidence_level': None,
+    'analysis_fps': None,
+    'analysis_size': None,  # [ширина, высота], None - по videotool.ANALYSIS_WIDTH
+    'roi_inference': True,
+    'zone': None,  # охраняемая зона - список точек [x, y]
+    'zone_size': None,  # [ширина, высота] кадра, в котором заданы точки зоны,
+                        # None - точки в координатах кадра анализа
+    'zone_min_overlap': None,
+    'record': True,
+}
+
+SECURITY_DEFAULTS = {
+    'source': None,
+    'camera_id': 4,
+    'period_sec': 10,
+    'burst': 5,
+}
+
+MODES = {
+    'original': cameramode.ORIGINAL,
+    'objects': cameramode.DETECT_OBJECTS,
+    'motion': cameramode.DETECT_MOTION,
+    'motion_objects': cameramode.DETECT_MOTION_OBJECTS,
+}
+
+
+def merge(defaults, values):
+    result = copy.deepcopy(defaults)
+    for key, value in values.items():
+        if key not in defaults:
+            raise ValueError('Unknown config key: {}'.format(key))
+        if isinstance(defaults[key], dict) and isinstance(value, dict):
+            result[key] = merge(defaults[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def load_config(path):
+    with open(path, encoding='utf-8') as f:
+        return parse_config(json.load(f))
+
+
+def parse_config(values):
+    config = merge(DEFAULTS, values)
+    cameras = []
+    for i, camera_values in enumerate(config['cameras']):
+        camera = merge(CAMERA_DEFAULTS, camera_values)
+        if camera['source'] is None:
+            raise ValueError('Camera #{}: source is required'.format(i + 1))
+        if camera['id'] is None:
+            camera['id'] = i + 1
+        if camera['name'] is None:
+            camera['name'] = 'Камера №' + str(camera['id'])
+        for key in ('classes_to_detect', 'confidence_level', 'analysis_fps'):
+            if camera[key] is None:
+                camera[key] = config[key]
+        if camera['mode'] not in MODES:
+            raise ValueError('Camera #{}: unknown mode {}, expected one of {}'.format(
+                camera['id'], camera['mode'], ', '.join(MODES)))
+        if camera['zone'] is not None and len(camera['zone']) < 3:
+            raise ValueError('Camera #{}: zone needs at least 3 points'.format(camera['id']))
+        for key in ('analysis_size', 'zone_size'):
+            if camera[key] is not None:
+                camera[key] = tuple(camera[key])
+        if camera['zone'] is not None:
+            camera['zone'] = [tuple(point) for point in camera['zone']]
+        cameras.append(camera)
+    ids = [camera['id'] for camera in cameras]
+    if len(set(ids)) != len(ids):
+        raise ValueError('Camera ids must be unique: {}'.format(ids))
+    config['cameras'] = cameras
+    if config['security'] is not None:
+        config['security'] = merge(SECURITY_DEFAULTS, config['security'])
+        if config['security']['source'] is None:
+            raise ValueError('Security: source is required')
+    return config
+
+
+def load_labels(path):
+    with open(path) as f:
+        return [s.strip() for s in f.readlines()]
@@ -0,0 +1,119 @@
+import time
+from threading import Lock
+
+import cv2
+import numpy as np
+
+
+# Расписание одной камеры: период анализа (в кадрах) зависит от того,
+# сколько в последнее время менялось пикселей и находилось объектов
+class CameraSchedule:
+    def __init__(self, scheduler, name):
+        self.scheduler = scheduler
+        self.name = name
+        self.activity = 1.0  # от 0 (пустая сцена) до 1 (много движения), сначала считаем занятой
+        self.frames_since_analysis = 0
+        self.prev_thumb = None
+        self.changed_fraction = 0.0
+
+    def get_period(self):
+        sch = self.scheduler
+        return int(round(sch.max_period - (sch.max_period - sch.min_period) * self.activity))
+
+    # Вызывается на каждом кадре, возвращает True, если по периоду камеры кадр
+    # пора анализировать. Токен общего бюджета берётся отдельно через take_token,
+    # только когда детектор действительно запускается (после проверки движения)
+    def is_due(self, frame):
+        self.observe(frame)
+        self.frames_since_analysis += 1
+        return self.frames_since_analysis >= self.get_period()
+
+    def take_token(self):
+        if not self.scheduler.take_token():
+            return False  # общий бюджет исчерпан - попробуем на следующем кадре
+        self.frames_since_analysis = 0
+        return True
+
+    # Кадр было пора анализировать, но детектор не понадобился (мало движения)
+    def skip(self):
+        self.frames_since_analysis = 0
+
+    # Доля изменившихся пикселей на сильно уменьшенном сером кадре
+    def observe(self, frame):
+        sch = self.scheduler
+        thumb = cv2.cvtColor(cv2.resize(frame, sch.thumb_size, interpolation=cv2.INTER_AREA),
+                             cv2.COLOR_BGR2GRAY)
+        if self.prev_thumb is not None and self.prev_thumb.shape == thumb.shape:
+            diff = cv2.absdiff(thumb, self.prev_thumb)
+            self.changed_fraction = np.count_nonzero(diff > sch.change_level) / diff.size
+            self.update_activity(min(1.0, self.changed_fraction / sch.busy_change))
+        self.prev_thumb = thumb
+
+    def report_detections(self, count, inference_sec):
+        self.update_activity(min(1.0, count / self.scheduler.busy_detections))
+        self.scheduler.report_inference(inference_sec)
+
+    def update_activity(self, value):
+        k = self.scheduler.smoothing
+        # рост активности учитываем сразу, спад - плавно
+        self.activity = max(value, (1 - k) * self.activity + k * value)
+
+
+# Общий для всех камер планировщик: раздаёт запуски детектора
+# по токенам с ограничением на число запусков в секунду
+class DetectionScheduler:
+    def __init__(self, max_inferences_per_sec=10.0, cpu_budget=2.0,
+                 min_period=3, max_period=60, smoothing=0.05,
+                 thumb_size=(32, 24), change_level=20, busy_change=0.05,
+                 busy_detections=3):
+        self.max_inferences_per_sec = max_inferences_per_sec
+        self.cpu_budget = cpu_budget  # сколько ядер можно отдать под инференс
+        self.min_period = min_period
+        self.max_period = max_period
+        self.smoothing = smoothing
+        self.thumb_size = thumb_size
+        self.change_level = change_level
+        self.busy_change = busy_change  # доля изменившихся пикселей для активности 1
+        self.busy_detections = busy_detections  # число объектов для активности 1
+
+        self.schedules = []
+        self.lock = Lock()
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.avg_inference_sec = 0.0
+
+    def register(self, name):
+        with self.lock:
+            schedule = CameraSchedule(self, name)
+            self.schedules.append(schedule)
+            return schedule
+
+    def unregister(self, schedule):
+        with self.lock:
+            if schedule in self.schedules:
+                self.schedules.remove(schedule)
+
+    # Допустимое число запусков в секунду с учётом времени одного запуска
+    def get_rate(self):
+        rate = self.max_inferences_per_sec
+        if self.avg_inference_sec > 0:
+            rate = min(rate, self.cpu_budget / self.avg_inference_sec)
+        return rate
+
+    def take_token(self):
+        with self.lock:
+            now = time.monotonic()
+            burst = max(1, len(self.schedules))
+            self.tokens = min(burst, self.tokens + (now - self.last_refill) * self.get_rate())
+            self.last_refill = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def report_inference(self, inference_sec):
+        with self.lock:
+            if self.avg_inference_sec == 0:
+                self.avg_inference_sec = inference_sec
+            else:
+                self.avg_inference_sec = 0.9 * self.avg_inference_sec + 0.1 * inference_sec
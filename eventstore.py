@@ -0,0 +1,172 @@
+import queue
+import sqlite3
+import time
+import traceback
+from datetime import datetime
+from threading import Thread
+
+BATCH_SIZE = 256  # событий в одной транзакции
+FLUSH_PERIOD_SEC = 1.0  # дольше событие в очереди не лежит
+
+# Виды событий
+KIND_GUARD = 0  # охранник появился или ушёл (message - 'на месте'/'отсутствует')
+KIND_DETECTION = 1  # в кадре появился новый объект
+KIND_ZONE_ENTRY = 2  # объект вошёл в охраняемую зону
+KIND_CAMERA_FAULT = 3  # видеопоток пропал или восстановился
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS events (
+           id INTEGER PRIMARY KEY,
+           ts REAL NOT NULL,
+           camera INTEGER NOT NULL,
+           kind INTEGER NOT NULL,
+           class TEXT,
+           score REAL,
+           x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+           frame_w INTEGER, frame_h INTEGER,
+           message TEXT)''',
+    'CREATE INDEX IF NOT EXISTS events_ts ON events (ts)',
+    'CREATE INDEX IF NOT EXISTS events_camera_ts ON events (camera, ts)',
+    # "все входы людей в зону на камере 2 за неделю"
+    'CREATE INDEX IF NOT EXISTS events_kind_camera_ts ON events (kind, camera, ts)',
+]
+
+INSERT = '''INSERT INTO events (ts, camera, kind, class, score, x1, y1, x2, y2,
+                                frame_w, frame_h, message)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+STOP = None  # признак конца очереди
+
+
+# Журнал событий в SQLite (WAL: чтение не мешает записи). add не блокирует
+# вызывающий поток - события копятся в очереди и пишутся пачками
+# в одной транзакции из своего потока
+class EventStore(Thread):
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_period_sec=FLUSH_PERIOD_SEC):
+        super().__init__(name='EventStore', daemon=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_period_sec = flush_period_sec
+        self.queue = queue.Queue()
+        self.written = 0
+        conn = self.connect()
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+        conn.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # box - (x1, y1, x2, y2) в кадре размера frame_size (width, height)
+    def add(self, kind, camera, cls=None, score=None, box=None, frame_size=None,
+            message=None, ts=None):
+        if ts is None:
+            ts = time.time()
+        x1, y1, x2, y2 = box if box is not None else (None, None, None, None)
+        frame_w, frame_h = frame_size if frame_size is not None else (None, None)
+        self.queue.put((ts, camera, kind, cls, score, x1, y1, x2, y2, frame_w, frame_h, message))
+
+    def run(self):
+        conn = self.connect()
+        batch = []
+        deadline = time.monotonic() + self.flush_period_sec
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = ()
+                if item is STOP:
+                    break
+                if item:
+                    batch.append(item)
+                if len(batch) >= self.batch_size or \
+                        (len(batch) > 0 and time.monotonic() >= deadline):
+                    self.write_batch(conn, batch)
+                    batch = []
+                if len(batch) == 0:
+                    deadline = time.monotonic() + self.flush_period_sec
+        except:
+            print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
+        finally:
+            if len(batch) > 0:
+                self.write_batch(conn, batch)
+            conn.close()
+        print('{}: done! Events written: {}'.format(self.getName(), self.written))
+
+    def write_batch(self, conn, batch):
+        with conn:
+            conn.executemany(INSERT, batch)
+        self.written += len(batch)
+
+    def close(self):
+        self.queue.put(STOP)
+        if self.is_alive():
+            self.join()
+
+    # События по убыванию времени. Все условия необязательны, before - (ts, id)
+    # последнего прочитанного события для постраничного чтения
+    def query(self, camera=None, kind=None, cls=None, start_ts=None, end_ts=None,
+              before=None, limit=1000):
+        conditions, args = self.get_conditions(camera, kind, cls, start_ts, end_ts)
+        if before is not None:
+            conditions.append('(ts < ? OR (ts = ? AND id < ?))')
+            args.extend((before[0], before[0], before[1]))
+        return self.select(conditions, args, 'ts DESC, id DESC', limit)
+
+    # События, записанные после события after_id, в порядке записи (для слежения за журналом)
+    def query_new(self, after_id, camera=None, kind=None, cls=None, start_ts=None, end_ts=None,
+                  limit=1000):
+        conditions, args = self.get_conditions(camera, kind, cls, start_ts, end_ts)
+        conditions.append('id > ?')
+        args.append(after_id)
+        return self.select(conditions, args, 'id', limit)
+
+    def get_last_id(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT MAX(id) FROM events').fetchone()[0] or 0
+        finally:
+            conn.close()
+
+    def get_conditions(self, camera, kind, cls, start_ts, end_ts):
+        conditions = []
+        args = []
+        for column, op, value in (('camera', '=', camera), ('kind', '=', kind), ('class', '=', cls),
+                                  ('ts', '>=', start_ts), ('ts', '<', end_ts)):
+            if value is not None:
+                conditions.append('{} {} ?'.format(column, op))
+                args.append(value)
+        return conditions, args
+
+    def select(self, conditions, args, order, limit):
+        sql = 'SELECT * FROM events'
+        if len(conditions) > 0:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY {} LIMIT ?'.format(order)
+        conn = self.connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            return conn.execute(sql, args + [limit]).fetchall()
+        finally:
+            conn.close()
+
+
+def describe(event):
+    kind = event['kind']
+    if kind == KIND_GUARD:
+        text = 'охранник {}'.format(event['message'])
+    elif kind == KIND_DETECTION:
+        text = 'обнаружен объект: {}'.format(event['class'])
+    elif kind == KIND_ZONE_ENTRY:
+        text = 'объект в охраняемой зоне: {}'.format(event['class'])
+    else:
+        text = event['message'] or ''
+    if event['score'] is not None:
+        text += ' ({:.0%})'.format(event['score'])
+    return '{} - Камера №{} - {}'.format(datetime.fromtimestamp(event['ts']).strftime('%d.%m.%y %H:%M:%S'),
+                                         event['camera'], text)
@@ -1 +1 @@
-__all__ = ['object_detector', 'motion_detector', 'border_detector']
+__all__ = ['object_detector', 'motion_detector', 'border_detector', 'inference_scheduler', 'model_registry', 'tracker']
@@ -1,29 +1,22 @@
 import numpy as np
 import cv2
-import tensorflow as tf
 from datetime import datetime
+from threading import Lock
 
 
 # сделать staticmethod/classmethod?
 def mouse_drawing(event, x, y, flags, detector):
     if event == cv2.EVENT_LBUTTONDOWN:
         detector.points.append((x, y))
+        detector.invalidate_mask()
     elif event == cv2.EVENT_RBUTTONDOWN:
         if len(detector.points) > 0:
             detector.points.pop()
+            detector.invalidate_mask()
     elif event == cv2.EVENT_MOUSEMOVE:
         detector.next_point = (x, y)
 
 
-def in_region(x, y, xp, yp):
-    c = False
-    for i in range(len(xp)):
-        if (((yp[i] <= y and y < yp[i - 1]) or (yp[i - 1] <= y and y < yp[i])) and \
-                (x > (xp[i - 1] - xp[i]) * (y - yp[i]) / (yp[i - 1] - yp[i]) + xp[i])):
-            c = not c
-    return c
-
-
 class BorderDetector:
     def __init__(self):
         # сделать points изначально np.ndarray чтобы каждый раз не превращать в np_points?
@@ -32,6 +25,20 @@ class BorderDetector:
         self.is_drawing = False
         self.has_regions = False
         self.window_id = None
+        self.points_size = None  # (width, height) кадра, на котором рисовались точки
+        # растровые маски областей (1 - внутри) и их интегральные изображения
+        # по размеру кадра: (width, height) -> (mask, integral). Строятся при первой
+        # проверке и сбрасываются при изменении points. Проверки идут и из потока
+        # анализа, и из потока показа, поэтому построение - под mask_lock
+        self.masks = {}
+        self.mask_lock = Lock()
+
+    # Точки областей в координатах кадра размером width x height
+    def get_points(self, width, height):
+        np_points = np.array(self.points, dtype=np.float64).reshape(-1, 2)
+        if self.points_size is not None and self.points_size != (width, height):
+            np_points *= (width / self.points_size[0], height / self.points_size[1])
+        return np_points
 
     def draw_regions(self, frame, color, thickness):
         #regions_frame = np.copy(frame)
@@ -42,7 +49,7 @@ class BorderDetector:
             else:
                 np_points = np.array([self.next_point])
         else:
-            np_points = np.array(self.points)
+            np_points = self.get_points(frame.shape[1], frame.shape[0])
 
         """for center_position in self.points:
             cv2.circle(regions_frame, center_position, 2, (0, 0, 255), -1)"""
@@ -55,23 +62,71 @@ class BorderDetector:
             regions_frame = cv2.bitwise_and(regions_frame, stencil)"""
         return frame
 
-    def are_rectangles_in_regions(self, rectangles):
-        np_points = np.array(self.points)
-        result = []
-        for i in range(len(rectangles)):
-            result.append(in_region((rectangles[i][1] + rectangles[i][3]) / 2,
-                                    (rectangles[i][0] + rectangles[i][2]) / 2,
-                                    np_points[:, 0],
-                                    np_points[:, 1]))
-        return result
+    def invalidate_mask(self):
+        with self.mask_lock:
+            self.masks = {}
+
+    # Маска областей для кадра размером width x height и её интегральное изображение
+    def get_mask(self, width, height):
+        with self.mask_lock:
+            entry = self.masks.get((width, height))
+            if entry is None:
+                mask = np.zeros((height, width), dtype=np.uint8)
+                if len(self.points) >= 3:
+                    cv2.fillPoly(mask, np.int32([self.get_points(width, height)]), 1)
+                entry = (mask, cv2.integral(mask))
+                self.masks[(width, height)] = entry
+            return entry
 
+    # rectangles - рамки (x1, y1, x2, y2) в координатах кадра размером frame_size = (width, height).
+    # Если min_overlap не задан, рамка считается внутри, когда внутри её центр,
+    # иначе - когда внутри не меньше min_overlap (от 0 до 1) её площади.
+    def are_rectangles_in_regions(self, rectangles, frame_size, min_overlap=None):
+        width, height = frame_size
+        mask, integral = self.get_mask(width, height)
+        if len(rectangles) == 0:
+            return np.zeros(0, dtype=bool)
 
+        rects = np.array(rectangles, dtype=np.int64).reshape(-1, 4)
+        if min_overlap is None:
+            xs = np.clip((rects[:, 0] + rects[:, 2]) // 2, 0, width - 1)
+            ys = np.clip((rects[:, 1] + rects[:, 3]) // 2, 0, height - 1)
+            return mask[ys, xs].astype(bool)
+
+        x1 = np.clip(rects[:, 0], 0, width)
+        y1 = np.clip(rects[:, 1], 0, height)
+        x2 = np.clip(rects[:, 2], 0, width)
+        y2 = np.clip(rects[:, 3], 0, height)
+        inside = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        area = (rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])
+        return inside >= min_overlap * np.maximum(area, 1)
+
+    # Ограничивающий прямоугольник областей (x1, y1, x2, y2) с отступом margin,
+    # обрезанный по границам кадра width x height
+    def bounding_rect(self, width, height, margin=0):
+        if len(self.points) == 0:
+            return 0, 0, width, height
+        np_points = self.get_points(width, height)
+        x1, y1 = np_points.min(axis=0) - margin
+        x2, y2 = np_points.max(axis=0) + margin
+        return int(max(0, x1)), int(max(0, y1)), int(min(width, x2)), int(min(height, y2))
+
+    # Области, заданные заранее (например, в конфигурации), а не мышью.
+    # frame_size - (width, height) кадра, в координатах которого даны точки
+    def set_points(self, points, frame_size=None):
+        self.points = list(points)
+        self.points_size = frame_size
+        self.has_regions = len(self.points) >= 3
+        self.invalidate_mask()
 
     def clear_points(self):
             self.points = []
             self.has_regions = False
+            self.invalidate_mask()
 
-    def start_selecting_region(self, window_id):
+    # frame_size - (width, height) кадров, которые показываются в окне рисования
+    def start_selecting_region(self, window_id, frame_size=None):
+        self.points_size = frame_size
         self.is_drawing = True
         self.window_id = window_id
         cv2.namedWindow(self.window_id)
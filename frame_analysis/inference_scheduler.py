@@ -0,0 +1,114 @@
+import time
+import traceback
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+from threading import Thread, Condition
+
+import numpy as np
+
+
+# Общий для всех камер сервис инференса: копит кадры от всех ObjectDetector'ов
+# и прогоняет их одним пакетным sess.run. Накладные расходы на вызов сети
+# платятся один раз на пакет, а не на каждый кадр.
+class InferenceScheduler(Thread):
+    # model - ModelHandle из ModelRegistry
+    def __init__(self, model, max_batch_size=4, max_wait_ms=15):
+        super().__init__(name='InferenceScheduler', daemon=True)
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+
+        self.pending = deque()  # (время поступления, кадр, Future)
+        self.cond = Condition()
+        self.is_stopped = False
+
+        self.batches = 0  # вызовов сети
+        self.frames = 0  # кадров во всех пакетах
+        self.busy_sec = 0.0  # суммарное время вызовов сети
+
+    # Ставит кадр в очередь, результат - Future с кортежем
+    # (boxes, scores, classes, num) в формате sess.run для пакета из одного кадра.
+    # future.inference_sec - доля кадра во времени sess.run его пакета
+    def submit(self, frame):
+        future = Future()
+        with self.cond:
+            if self.is_stopped:
+                future.set_exception(RuntimeError('InferenceScheduler is stopped'))
+                return future
+            self.pending.append((time.monotonic(), frame, future))
+            self.cond.notify()
+        return future
+
+    def process(self, frame):
+        return self.submit(frame).result()
+
+    def run(self):
+        print('Hello, I\'m {}'.format(self.getName()))
+        while True:
+            with self.cond:
+                while not self.pending and not self.is_stopped:
+                    self.cond.wait()
+                if not self.pending:
+                    break
+                # ждём, пока наберётся пакет, но не дольше max_wait_ms
+                # с момента поступления самого старого кадра
+                deadline = self.pending[0][0] + self.max_wait_ms / 1000
+                while len(self.pending) < self.max_batch_size and not self.is_stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch = [self.pending.popleft()
+                         for _ in range(min(len(self.pending), self.max_batch_size))]
+            self.run_batch(batch)
+        print('It\'s {}, goodbye!'.format(self.getName()))
+
+    def run_batch(self, batch):
+        # сеть принимает пакет только из кадров одинакового размера
+        groups = OrderedDict()
+        for _, frame, future in batch:
+            groups.setdefault(np.shape(frame), []).append((frame, future))
+
+        for items in groups.values():
+            futures = [future for _, future in items]
+            try:
+                frames = np.stack([frame for frame, _ in items])
+                time_start = time.perf_counter()
+                outputs = self.model.run(frames)
+                run_sec = time.perf_counter() - time_start
+                self.busy_sec += run_sec
+                self.batches += 1
+                self.frames += len(items)
+            except Exception as e:
+                print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for i, future in enumerate(futures):
+                future.inference_sec = run_sec / len(items)
+                future.set_result(tuple(out[i:i + 1] for out in outputs))
+
+    # Можно менять на ходу, например при добавлении камер
+    def set_max_batch_size(self, max_batch_size):
+        with self.cond:
+            self.max_batch_size = max(1, max_batch_size)
+            self.cond.notify()
+
+    def get_stats(self):
+        with self.cond:
+            pending = len(self.pending)
+        return {'batches': self.batches,
+                'frames': self.frames,
+                'busy_sec': self.busy_sec,
+                'pending': pending}
+
+    def stop(self):
+        with self.cond:
+            self.is_stopped = True
+            self.cond.notify_all()
+
+    def close(self):
+        self.stop()
+        if self.is_alive():
+            self.join()
+        self.model.release()
@@ -0,0 +1,97 @@
+from threading import Lock
+
+import tensorflow as tf
+
+
+class LoadedModel:
+    def __init__(self, model_path, intra_op_threads, inter_op_threads):
+        self.model_path = model_path
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            od_graph_def = tf.GraphDef()
+            with tf.gfile.GFile(model_path, 'rb') as fid:
+                serialized_graph = fid.read()
+                od_graph_def.ParseFromString(serialized_graph)
+                tf.import_graph_def(od_graph_def, name='')
+
+        # 0 - значение по умолчанию TF (по числу ядер)
+        config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                inter_op_parallelism_threads=inter_op_threads)
+        self.sess = tf.Session(graph=self.graph, config=config)
+
+        # Definite input and output Tensors for detection_graph
+        self.image_tensor = self.graph.get_tensor_by_name('image_tensor:0')
+        self.fetches = [self.graph.get_tensor_by_name('detection_boxes:0'),
+                        self.graph.get_tensor_by_name('detection_scores:0'),
+                        self.graph.get_tensor_by_name('detection_classes:0'),
+                        self.graph.get_tensor_by_name('num_detections:0')]
+        self.ref_count = 0
+
+    def close(self):
+        self.sess.close()
+
+
+# Ссылка на загруженную модель. Сессия общая для всех владельцев
+# (tf.Session.run потокобезопасен), release() вызывается ровно один раз.
+class ModelHandle:
+    def __init__(self, registry, model):
+        self.registry = registry
+        self.model = model
+        self.is_released = False
+
+    @property
+    def graph(self):
+        return self.model.graph
+
+    # frames - пакет кадров формы [N, H, W, 3],
+    # возвращает (boxes, scores, classes, num)
+    def run(self, frames):
+        return self.model.sess.run(self.model.fetches,
+                                   feed_dict={self.model.image_tensor: frames})
+
+    def release(self):
+        if not self.is_released:
+            self.is_released = True
+            self.registry.release(self.model.model_path)
+
+
+# Загружает каждый замороженный граф один раз и раздаёт на него
+# ссылки с подсчётом. Сессия закрывается, когда отпущена последняя ссылка.
+class ModelRegistry:
+    def __init__(self, intra_op_threads=0, inter_op_threads=0):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.models = {}
+        self.lock = Lock()
+
+    def acquire(self, model_path):
+        with self.lock:
+            model = self.models.get(model_path)
+            if model is None:
+                print('ModelRegistry: loading', model_path)
+                model = LoadedModel(model_path,
+                                    self.intra_op_threads,
+                                    self.inter_op_threads)
+                self.models[model_path] = model
+            model.ref_count += 1
+            return ModelHandle(self, model)
+
+    def release(self, model_path):
+        with self.lock:
+            model = self.models.get(model_path)
+            if model is None:
+                return
+            model.ref_count -= 1
+            if model.ref_count <= 0:
+                print('ModelRegistry: unloading', model_path)
+                del self.models[model_path]
+                model.close()
+
+    # Закрывает все сессии, даже если кто-то не отпустил ссылку
+    def close(self):
+        with self.lock:
+            for model_path, model in self.models.items():
+                if model.ref_count > 0:
+                    print('ModelRegistry: {} still has {} reference(s)'.format(model_path, model.ref_count))
+                model.close()
+            self.models.clear()
@@ -56,9 +56,10 @@ class MotionDetector(IFrameAnalyzer):
         thresh_frame = cv2.dilate(thresh_frame, None,
                                   iterations=self.dilate_value)
 
-        (_, all_contours, _) = cv2.findContours(thresh_frame.copy(),
-                                                cv2.RETR_EXTERNAL,
-                                                cv2.CHAIN_APPROX_SIMPLE)
+        # OpenCV 3 возвращает (image, contours, hierarchy), OpenCV 4 - (contours, hierarchy)
+        all_contours = cv2.findContours(thresh_frame.copy(),
+                                        cv2.RETR_EXTERNAL,
+                                        cv2.CHAIN_APPROX_SIMPLE)[-2]
         ret_contours = []
         for contour in all_contours:
             if cv2.contourArea(contour) < self.min_area:
@@ -1,76 +1,101 @@
+import time
+
 import numpy as np
-import tensorflow as tf
 
 from .i_frame_analyzer import IFrameAnalyzer
 
 
+# Одна обнаруженная область: рамка (x1, y1, x2, y2) в пикселях кадра,
+# уверенность сети и номер класса (нумерация с 1, см. classes_en.txt)
+DETECTION_DTYPE = np.dtype([('box', np.int32, (4,)),
+                            ('score', np.float32),
+                            ('class_id', np.int32)])
+
+
 class ObjectDetector(IFrameAnalyzer):
-    # bad code
-    def __init__(self, detection_graph, labels, classes_to_detect, confidence_level):
-        super().__init__()      
-        self.detection_graph = detection_graph      
-        """self.detection_graph = tf.Graph()
-        with self.detection_graph.as_default():
-            od_graph_def = tf.GraphDef()
-            with tf.gfile.GFile(path_to_ckpt, 'rb') as fid:
-                serialized_graph = fid.read()
-                od_graph_def.ParseFromString(serialized_graph)
-                tf.import_graph_def(od_graph_def, name='')"""
-
-        self.default_graph = self.detection_graph.as_default()
-        self.sess = tf.Session(graph=self.detection_graph)
+    # model - ModelHandle из ModelRegistry: граф и сессия общие для всех детекторов
+    def __init__(self, model, labels, classes_to_detect, confidence_level,
+                 scheduler=None):
+        super().__init__()
+        self.model = model
+        # если задан общий InferenceScheduler, кадры уходят в него пакетами
+        self.scheduler = scheduler
         self.labels = labels
+        self.last_inference_sec = 0.0  # время сети на последнем кадре (доля пакета)
 
-        # Definite input and output Tensors for detection_graph
-        self.image_tensor = self.detection_graph.get_tensor_by_name('image_tensor:0')
-        # Each box represents a part of the image where a particular object was detected.
-        self.detection_boxes = self.detection_graph.get_tensor_by_name('detection_boxes:0')
-        # Each score represent how level of confidence for each of the objects.
-        # Score is shown on the result image, together with the class label.
-        self.detection_scores = self.detection_graph.get_tensor_by_name('detection_scores:0')
-        self.detection_classes = self.detection_graph.get_tensor_by_name('detection_classes:0')
-        self.num_detections = self.detection_graph.get_tensor_by_name('num_detections:0')
+        self.confidence_level = confidence_level
+        self.set_classes_to_detect(classes_to_detect)
 
+    def set_classes_to_detect(self, classes_to_detect):
         self.classes_to_detect = classes_to_detect
-        self.confidence_level = confidence_level
+        # таблица "номер класса -> нужен ли он", чтобы фильтровать без циклов
+        self.class_mask = np.zeros(len(self.labels) + 1, dtype=bool)
+        for class_id in classes_to_detect:
+            if 0 < class_id < len(self.class_mask):
+                self.class_mask[class_id] = True
 
     def process(self, frame):
+        return self.to_lists(self.detect(frame))
+
+    # Обнаружение только внутри прямоугольника rect = (x1, y1, x2, y2),
+    # рамки возвращаются в координатах всего кадра
+    def process_region(self, frame, rect):
+        return self.to_lists(self.detect_region(frame, rect))
+
+    def to_lists(self, detections):
+        boxes = list(map(tuple, detections['box'].tolist()))
+        scores = detections['score'].tolist()
+        labels = [self.labels[class_id - 1] for class_id in detections['class_id'].tolist()]
+        return boxes, scores, labels
+
+    # То же, что process, но результат - один структурированный массив DETECTION_DTYPE
+    def detect(self, frame):
+        self.last_inference_sec = 0.0
         if len(self.classes_to_detect) <= 0 or self.confidence_level > 1:
-            return [], [], []
+            return np.empty(0, dtype=DETECTION_DTYPE)
+
+        # Actual detection.
+        (boxes, scores, classes, num) = self.run_inference(frame)
+
+        im_height, im_width = frame.shape[:2]
+        return self.postprocess(boxes[0], scores[0], classes[0], im_width, im_height)
+
+    def detect_region(self, frame, rect):
+        x1, y1, x2, y2 = rect
+        if x2 <= x1 or y2 <= y1:
+            return np.empty(0, dtype=DETECTION_DTYPE)
+        detections = self.detect(frame[y1:y2, x1:x2])
+        detections['box'] += np.array([x1, y1, x1, y1], dtype=np.int32)
+        return detections
+
+    # boxes - нормированные (ymin, xmin, ymax, xmax), как их отдаёт сеть
+    def postprocess(self, boxes, scores, classes, im_width, im_height):
+        class_ids = classes.astype(np.int32)
+        np.clip(class_ids, 0, len(self.class_mask) - 1, out=class_ids)
+        keep = np.flatnonzero(self.class_mask[class_ids] & (scores > self.confidence_level))
+
+        detections = np.empty(len(keep), dtype=DETECTION_DTYPE)
+        # (ymin, xmin, ymax, xmax) -> (x1, y1, x2, y2) и масштаб к размеру кадра
+        detections['box'] = boxes[keep][:, [1, 0, 3, 2]] * \
+            np.array([im_width, im_height, im_width, im_height], dtype=np.float32)
+        detections['score'] = scores[keep]
+        detections['class_id'] = class_ids[keep]
+        return detections
+
+    def run_inference(self, frame):
+        if self.scheduler is not None:
+            future = self.scheduler.submit(frame)
+            outputs = future.result()
+            self.last_inference_sec = future.inference_sec
+            return outputs
 
         # Expand dimensions since the trained_model expects frames to have shape: [1, None, None, 3]
         frame_np_expanded = np.expand_dims(frame, axis=0)
+        time_start = time.perf_counter()
+        outputs = self.model.run(frame_np_expanded)
+        self.last_inference_sec = time.perf_counter() - time_start
+        return outputs
 
-        # Actual detection.
-        (boxes, scores, classes, num) = self.sess.run(
-            [self.detection_boxes, self.detection_scores, self.detection_classes, self.num_detections],
-            feed_dict={self.image_tensor: frame_np_expanded})
-
-        im_height, im_width, _ = frame.shape
-        all_boxes = []
-        for i in range(boxes.shape[1]):
-            all_boxes.append((int(boxes[0, i, 1] * im_width),
-                              int(boxes[0, i, 0] * im_height),
-                              int(boxes[0, i, 3] * im_width),
-                              int(boxes[0, i, 2] * im_height)))
-
-        all_scores = scores[0].tolist()
-        all_classes = [int(x) for x in classes[0].tolist()]
-        all_labels = [self.labels[int(x) - 1] for x in all_classes]
-
-        ret_boxes = []
-        ret_scores = []
-        ret_labels = []
-        for i in range(len(all_boxes)):
-            if all_classes[i] in self.classes_to_detect and all_scores[i] > self.confidence_level:
-                ret_boxes.append(all_boxes[i])
-                ret_scores.append(all_scores[i])
-                ret_labels.append(all_labels[i])
-
-        # чем полезен int(num[0]) ?
-        # print('len(all_boxes) =', len(ret_boxes), 'int(num[0]) =', int(num[0]))
-        return ret_boxes, ret_scores, ret_labels
-
+    # Отпускает ссылку на модель; сессию закрывает ModelRegistry
     def close(self):
-        self.sess.close()
-        # self.default_graph.close()  # AttributeError: '_GeneratorContextManager' object has no attribute 'close'
+        self.model.release()
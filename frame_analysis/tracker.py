@@ -0,0 +1,104 @@
+import numpy as np
+
+
+# Попарные IoU рамок (x1, y1, x2, y2): a - [N, 4], b - [M, 4] -> [N, M]
+def iou_matrix(a, b):
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+class Track:
+    def __init__(self, track_id, box, label, score=None):
+        self.track_id = track_id
+        self.label = label
+        self.score = score  # уверенность последнего обнаружения
+        self.box = np.array(box, dtype=np.float64)  # текущее (предсказанное) положение
+        self.last_box = self.box.copy()  # положение по последнему обнаружению
+        self.velocity = np.zeros(4)  # смещение рамки за один кадр
+        self.frames_since_update = 0
+        self.misses = 0
+
+
+# Простейший трекер между запусками детектора: сопоставление по IoU
+# и предсказание положения с постоянной скоростью. Даёт рамкам
+# устойчивые номера и двигает их на кадрах, где детектор не запускался.
+class IouTracker:
+    def __init__(self, iou_threshold=0.3, max_misses=2, max_predict_frames=30, smoothing=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses  # сколько обнаружений подряд трек может не найтись
+        self.max_predict_frames = max_predict_frames  # дальше рамка не экстраполируется
+        self.smoothing = smoothing  # вес новой оценки скорости
+        self.tracks = []
+        self.next_id = 1
+
+    # Вызывается на кадрах с обнаружением
+    def update(self, boxes, labels=None, scores=None):
+        if labels is None:
+            labels = [None] * len(boxes)
+        if scores is None:
+            scores = [None] * len(boxes)
+
+        matched_tracks = set()
+        matched_boxes = set()
+        if len(self.tracks) > 0 and len(boxes) > 0:
+            ious = iou_matrix(np.array([t.box for t in self.tracks]),
+                              np.array(boxes, dtype=np.float64).reshape(-1, 4))
+            # жадно: сначала пары с наибольшим IoU
+            for flat in np.argsort(ious, axis=None)[::-1]:
+                ti, bi = np.unravel_index(flat, ious.shape)
+                if ious[ti, bi] < self.iou_threshold:
+                    break
+                if ti in matched_tracks or bi in matched_boxes or \
+                        self.tracks[ti].label != labels[bi]:
+                    continue
+                matched_tracks.add(ti)
+                matched_boxes.add(bi)
+                self.correct(self.tracks[ti], boxes[bi])
+                self.tracks[ti].score = scores[bi]
+
+        alive = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            alive.append(track)
+        for bi in range(len(boxes)):
+            if bi not in matched_boxes:
+                alive.append(Track(self.next_id, boxes[bi], labels[bi], scores[bi]))
+                self.next_id += 1
+        self.tracks = alive
+
+    def correct(self, track, box):
+        box = np.array(box, dtype=np.float64)
+        if track.frames_since_update > 0:
+            velocity = (box - track.last_box) / track.frames_since_update
+            track.velocity = self.smoothing * velocity + (1 - self.smoothing) * track.velocity
+        track.box = box
+        track.last_box = box.copy()
+        track.frames_since_update = 0
+        track.misses = 0
+
+    # Вызывается на каждом кадре без обнаружения
+    def predict(self):
+        for track in self.tracks:
+            track.frames_since_update += 1
+            if track.frames_since_update <= self.max_predict_frames:
+                track.box += track.velocity
+
+    # Рамки (в целых пикселях), метки и номера текущих треков
+    def get_tracks(self):
+        boxes = [tuple(int(v) for v in track.box) for track in self.tracks]
+        labels = [track.label for track in self.tracks]
+        ids = [track.track_id for track in self.tracks]
+        return boxes, labels, ids
+
+    def clear(self):
+        self.tracks = []
@@ -0,0 +1,110 @@
+from collections import deque
+from threading import Condition
+
+
+# Ячейка для передачи последнего кадра от читающего потока к обрабатывающему.
+# Каждый кадр получает номер, потребитель ждёт кадр новее уже обработанного.
+class FrameSlot:
+    def __init__(self, name='subscriber'):
+        self.name = name  # кто читает ячейку, для метрик
+        self.cond = Condition()
+        self.frame = None
+        self.seq = 0  # номер последнего положенного кадра
+        self.consumed_seq = 0  # номер последнего забранного кадра
+        self.is_closed = False
+        self.is_active = True  # False - кадры пока не нужны, источник их не декодирует
+
+        self.received = 0  # всего положено кадров
+        self.dropped = 0  # кадры, перезаписанные до того, как их забрали
+        self.empty_waits = 0  # get, вернувшие None: за timeout новый кадр не пришёл
+
+    def put(self, frame):
+        with self.cond:
+            if self.consumed_seq < self.seq:
+                self.dropped += 1
+            self.frame = frame
+            self.seq += 1
+            self.received += 1
+            self.cond.notify_all()
+
+    # Ждёт кадр с номером больше last_seq. Возвращает (seq, frame),
+    # либо (last_seq, None), если за timeout секунд новый кадр не пришёл.
+    # Статистику ведёт только основной потребитель (count_stats=True),
+    # остальные читают ячейку, не влияя на счётчики
+    def get(self, last_seq, timeout=None, count_stats=True):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > last_seq or self.is_closed, timeout)
+            if self.seq <= last_seq:
+                if count_stats:
+                    self.empty_waits += 1
+                return last_seq, None
+            if count_stats:
+                self.consumed_seq = self.seq
+            return self.seq, self.frame
+
+    def close(self):
+        with self.cond:
+            self.is_closed = True
+            self.cond.notify_all()
+
+    def get_stats(self):
+        with self.cond:
+            return {'received': self.received,
+                    'dropped': self.dropped,
+                    'empty_waits': self.empty_waits,
+                    'queued': 1 if self.consumed_seq < self.seq else 0}
+
+
+# Очередь кадров ограниченной длины с тем же интерфейсом, что у FrameSlot:
+# потребитель получает кадры по порядку, при переполнении теряются самые старые
+class FrameQueue:
+    def __init__(self, maxlen, name='subscriber'):
+        self.name = name
+        self.cond = Condition()
+        self.frames = deque()
+        self.maxlen = maxlen
+        self.seq = 0
+        self.is_closed = False
+        self.is_active = True
+
+        self.received = 0
+        self.dropped = 0  # кадры, вытесненные из полной очереди
+        self.empty_waits = 0
+
+    def put(self, frame):
+        with self.cond:
+            if len(self.frames) >= self.maxlen:
+                self.frames.popleft()
+                self.dropped += 1
+            self.seq += 1
+            self.frames.append((self.seq, frame))
+            self.received += 1
+            self.cond.notify_all()
+
+    # Возвращает самый старый кадр из очереди, last_seq оставлен
+    # для совместимости с FrameSlot
+    def get(self, last_seq, timeout=None, count_stats=True):
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.frames) > 0 or self.is_closed, timeout)
+            if len(self.frames) == 0:
+                if count_stats:
+                    self.empty_waits += 1
+                return last_seq, None
+            return self.frames.popleft()
+
+    # Выбрасывает накопившиеся кадры, чтобы следующие были свежими
+    def clear(self):
+        with self.cond:
+            self.frames.clear()
+
+    def close(self):
+        with self.cond:
+            self.is_closed = True
+            self.cond.notify_all()
+
+    def get_stats(self):
+        with self.cond:
+            return {'received': self.received,
+                    'dropped': self.dropped,
+                    'empty_waits': self.empty_waits,
+                    'queued': len(self.frames)}
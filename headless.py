@@ -0,0 +1,121 @@
+import signal
+import sys
+from threading import Event, Lock
+
+from config import load_config
+from capturehub import CaptureHub
+from eventstore import EventStore
+from metrics import MetricsServer
+from workers import AnalysisWorker, SecurityDetectorWorker, CameraStateLog, CameraFactory
+
+STATS_PERIOD_SEC = 60  # как часто печатать статистику захвата
+
+
+# Обработка без интерфейса и без дисплея: захват, поиск движения и объектов,
+# охраняемые зоны, проверка охранника, журнал и запись событий.
+# Кадры не рисуются и не масштабируются для показа, основной поток
+# камеры декодируется, только если он нужен записи или нет дополнительного
+class HeadlessServer:
+    def __init__(self, config):
+        self.config = config
+        self.stop_event = Event()
+        self.event_store = EventStore(config['events_db'])
+        self.camera_state_log = CameraStateLog(self.event_store)
+        self.capture_hub = CaptureHub()
+        self.factory = CameraFactory(config, self.capture_hub, self.event_store)
+        self.metrics_server = None
+        if config['metrics_port'] is not None:
+            self.metrics_server = MetricsServer(config['metrics_port'], config['metrics_host'])
+
+        self.videotools = []
+        self.analyzers = []
+        self.analysis_slots = []  # (источник, подписка) для отписки при остановке
+        for camera in config['cameras']:
+            vtool = self.factory.create_videotool(
+                camera, on_state=lambda state, camera_id=camera['id']:
+                    self.camera_state_log.update(camera_id, state))
+            source = vtool.sub_source if vtool.has_substream() else vtool.source
+            slot = source.subscribe(name='Analysis' + str(camera['id']))
+            self.analysis_slots.append((source, slot))
+            self.analyzers.append(AnalysisWorker('Analysis' + str(camera['id']), vtool, slot,
+                                                 camera['analysis_fps'], self.stop_event,
+                                                 count_stats=True))
+            self.videotools.append(vtool)
+
+        self.security_detector = None
+        self.security_thread = None
+        security = config['security']
+        if security is not None:
+            self.security_detector = self.factory.create_object_detector([1],  # person
+                                                                         config['confidence_level'])
+            self.security_thread = SecurityDetectorWorker(name='SecurityDetector',
+                                                          source=self.capture_hub.get_source(security['source']),
+                                                          object_detector=self.security_detector,
+                                                          checking_period_sec=security['period_sec'],
+                                                          checking_burst=security['burst'],
+                                                          mutex=Lock(),
+                                                          stop_event=self.stop_event,
+                                                          event_store=self.event_store,
+                                                          camera_id=security['camera_id'])
+
+    def start(self):
+        self.event_store.start()
+        self.factory.start()
+        for vtool in self.videotools:
+            if vtool.recorder is not None:
+                vtool.recorder.start()
+        for analyzer in self.analyzers:
+            analyzer.start()
+        if self.security_thread is not None:
+            self.security_thread.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        print('Headless server started: {} cameras'.format(len(self.videotools)))
+
+    # Работает до stop, периодически печатая статистику захвата
+    def run(self):
+        while not self.stop_event.wait(STATS_PERIOD_SEC):
+            for vtool in self.videotools:
+                sources = [s for s in (vtool.source, vtool.sub_source) if s is not None]
+                print('Camera #{}: {}'.format(vtool.camera_id,
+                                              ', '.join(str(s.get_stats()) for s in sources)))
+
+    # Можно вызывать из обработчика сигнала
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        self.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        for analyzer in self.analyzers:
+            if analyzer.is_alive():
+                analyzer.join()
+        if self.security_thread is not None and self.security_thread.is_alive():
+            self.security_thread.join()
+        for source, slot in self.analysis_slots:
+            source.unsubscribe(slot)
+        for vtool in self.videotools:
+            self.factory.release_videotool(vtool)
+        self.capture_hub.close()
+        if self.security_detector is not None:
+            self.security_detector.close()
+        self.factory.close()
+        self.event_store.close()
+        print('Headless server stopped')
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'config.json'
+    server = HeadlessServer(load_config(path))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: server.stop())
+    server.start()
+    try:
+        server.run()
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
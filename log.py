@@ -17,9 +17,24 @@ class Ui_Log(object):
         self.pushButton.setGeometry(QtCore.QRect(584, 30, 51, 41))
         self.pushButton.setText("")
         self.pushButton.setObjectName("pushButton")
-        self.textEdit = QtWidgets.QTextEdit(Log)
-        self.textEdit.setGeometry(QtCore.QRect(20, 110, 611, 571))
-        self.textEdit.setObjectName("textEdit")
+        self.dateCheckBox = QtWidgets.QCheckBox(Log)
+        self.dateCheckBox.setGeometry(QtCore.QRect(20, 110, 81, 22))
+        self.dateCheckBox.setObjectName("dateCheckBox")
+        self.dateFromEdit = QtWidgets.QDateTimeEdit(Log)
+        self.dateFromEdit.setGeometry(QtCore.QRect(105, 110, 150, 22))
+        self.dateFromEdit.setCalendarPopup(True)
+        self.dateFromEdit.setObjectName("dateFromEdit")
+        self.dateToEdit = QtWidgets.QDateTimeEdit(Log)
+        self.dateToEdit.setGeometry(QtCore.QRect(260, 110, 150, 22))
+        self.dateToEdit.setCalendarPopup(True)
+        self.dateToEdit.setObjectName("dateToEdit")
+        self.cameraComboBox = QtWidgets.QComboBox(Log)
+        self.cameraComboBox.setGeometry(QtCore.QRect(420, 110, 211, 22))
+        self.cameraComboBox.setObjectName("cameraComboBox")
+        self.listView = QtWidgets.QListView(Log)
+        self.listView.setGeometry(QtCore.QRect(20, 140, 611, 541))
+        self.listView.setUniformItemSizes(True)
+        self.listView.setObjectName("listView")
 
         self.retranslateUi(Log)
         QtCore.QMetaObject.connectSlotsByName(Log)
@@ -27,11 +42,9 @@ class Ui_Log(object):
     def retranslateUi(self, Log):
         _translate = QtCore.QCoreApplication.translate
         Log.setWindowTitle(_translate("Log", "Form"))
-        self.textEdit.setHtml(_translate("Log", "<!DOCTYPE HTML PUBLIC \"-//W3C//DTD HTML 4.0//EN\" \"http://www.w3.org/TR/REC-html40/strict.dtd\">\n"
-"<html><head><meta name=\"qrichtext\" content=\"1\" /><style type=\"text/css\">\n"
-"p, li { white-space: pre-wrap; }\n"
-"</style></head><body style=\" font-family:\'MS Shell Dlg 2\'; font-size:8.25pt; font-weight:400; font-style:normal;\">\n"
-"<p style=\"-qt-paragraph-type:empty; margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><br /></p></body></html>"))
+        self.dateCheckBox.setText(_translate("Log", "Период"))
+        self.dateFromEdit.setDisplayFormat(_translate("Log", "dd.MM.yy HH:mm"))
+        self.dateToEdit.setDisplayFormat(_translate("Log", "dd.MM.yy HH:mm"))
 
 import xz_rc
 
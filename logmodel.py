@@ -0,0 +1,82 @@
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+
+from eventstore import KIND_ZONE_ENTRY, KIND_CAMERA_FAULT, describe
+
+PAGE_SIZE = 200  # событий за одну подгрузку
+
+
+# Журнал событий для QListView, новые события сверху. Старые события
+# подгружаются страницами по мере прокрутки (canFetchMore/fetchMore),
+# новые добавляются сверху в tail. Фильтры применяются в запросах к EventStore,
+# весь журнал в память не загружается
+class EventLogModel(QAbstractListModel):
+    kind_colors = {KIND_ZONE_ENTRY: QColor(227, 28, 33),
+                   KIND_CAMERA_FAULT: QColor(255, 140, 0)}
+
+    def __init__(self, event_store, parent=None):
+        super().__init__(parent)
+        self.event_store = event_store
+        self.filters = {}
+        self.rows = []  # (ts, id, kind, текст), по убыванию времени
+        self.last_id = 0  # события новее этого добавляет tail
+        self.is_exhausted = False
+
+    # camera = None - все камеры, start_ts/end_ts = None - без ограничения
+    def set_filters(self, camera=None, start_ts=None, end_ts=None):
+        self.beginResetModel()
+        self.filters = {'camera': camera, 'start_ts': start_ts, 'end_ts': end_ts}
+        self.rows = []
+        self.is_exhausted = False
+        self.last_id = self.event_store.get_last_id()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.rows):
+            return None
+        ts, event_id, kind, text = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return text
+        if role == Qt.ForegroundRole and kind in self.kind_colors:
+            return QBrush(self.kind_colors[kind])
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.is_exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        before = None
+        if len(self.rows) > 0:
+            before = self.rows[-1][:2]
+        events = self.event_store.query(before=before, limit=PAGE_SIZE, **self.filters)
+        if len(events) < PAGE_SIZE:
+            self.is_exhausted = True
+        # записанные после set_filters события добавит tail
+        rows = [self.to_row(e) for e in events if e['id'] <= self.last_id]
+        if len(rows) == 0:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+
+    # Добавляет сверху события, записанные с прошлого вызова
+    def tail(self):
+        events = self.event_store.query_new(self.last_id, limit=PAGE_SIZE, **self.filters)
+        if len(events) == 0:
+            return
+        self.last_id = events[-1]['id']
+        rows = [self.to_row(e) for e in reversed(events)]
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        self.rows[0:0] = rows
+        self.endInsertRows()
+
+    @staticmethod
+    def to_row(event):
+        return event['ts'], event['id'], event['kind'], describe(event)
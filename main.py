@@ -1,11 +1,12 @@
 import logging
+import math
+import os
 import sys
 import time
 import traceback
 import gc
 
 import cv2
-import tensorflow as tf
 import numpy as np
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
@@ -20,11 +21,18 @@ import settings
 import log
 
 import cameramode
-from videotool import VideoTool
-from videoview import VideoView
-from frame_analysis.object_detector import ObjectDetector
-from frame_analysis.border_detector import BorderDetector
-from frame_analysis.motion_detector import MotionDetector
+from config import load_config, parse_config, DEFAULTS
+from videotool import TRACKED_PROCESS_PERIOD
+from videoview import VideoView, FrameCanvas
+from frameslot import FrameSlot
+from capturehub import CaptureHub, STATE_CONNECTING
+from cameraprocess import CameraProcess
+from eventstore import EventStore
+from logmodel import EventLogModel
+from videoplayer import VideoPlayerWindow
+from metrics import MetricsServer
+from workers import AnalysisWorker, SecurityDetectorWorker, CameraStateLog, CameraFactory, \
+    FRAME_WAIT_SEC
 
 from datetime import datetime
 
@@ -38,27 +46,15 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(logging.DEBUG)
 
-CAMERAS_COUNT = 3
-CONFIDENCE_LEVEL = 0.7  # HERE - нижний порог уверенности модели от 0 до 1.
-                        # 0.7 - объект в кадре будет обведён рамкой, если
-                        #       сеть уверена на 70% и выше
-CLASSES_TO_DETECT = [
-    1,      # person
-    17,     # cat
-    18      # dog
-]  # HERE - классы для обнаружения, см. файл classes_en.txt
-   # номер класса = номер строки, нумерация с 1
+CONFIG_PATH = 'config.json'  # настройки камер, см. config.py и config.example.json
+DISPLAY_MAX_FPS = 25  # предел частоты отрисовки каждой камеры
+LOG_TAIL_PERIOD_MS = 1000  # как часто окно журнала проверяет новые события
+OVERLAY_PERIOD_MS = 1000  # как часто обновляются метрики поверх видео
+# этапы в строках метрик поверх видео: показ и анализ
+OVERLAY_DISPLAY_STAGES = ['tick', 'lock_wait', 'resize', 'render', 'publish']
+OVERLAY_ANALYSIS_STAGES = ['analyze', 'analysis_resize', 'motion', 'objects']
 
 
-def get_image_qt(frame):
-    # решает проблему с искажением кадров
-    height, width, channels = np.shape(frame)
-    totalBytes = frame.nbytes
-    bytesPerLine = int(totalBytes / height)
-
-    qimg = QImage(frame.data, frame.shape[1], frame.shape[0], bytesPerLine, QImage.Format_RGB888)
-    return QPixmap.fromImage(qimg)
-
 # Иконка загрузки
 class Splash(QSplashScreen):
     def __init__(self, *arg, **args):
@@ -96,13 +92,48 @@ class SettingsWindow(QWidget, settings.Ui_SettingsForm):
 
 # Окно Log'a
 class LogWindow(QWidget, log.Ui_Log):
-    def __init__(self):
+    def __init__(self, event_store, camera_ids):
         super().__init__()
         self.setupUi(self)
         self.setWindowTitle('Log')
         self.pushButton.clicked.connect(self.returnToMain)
         self.setWindowIcon(QIcon("icon_log.png"))
 
+        self.model = EventLogModel(event_store, self)
+        self.listView.setModel(self.model)
+        self.cameraComboBox.addItem('Все камеры', None)
+        for camera_id in camera_ids:
+            self.cameraComboBox.addItem('Камера №' + str(camera_id), camera_id)
+        now = QDateTime.currentDateTime()
+        self.dateFromEdit.setDateTime(now.addDays(-1))
+        self.dateToEdit.setDateTime(now)
+        self.apply_filters()
+        self.cameraComboBox.currentIndexChanged.connect(self.apply_filters)
+        self.dateCheckBox.toggled.connect(self.apply_filters)
+        self.dateFromEdit.dateTimeChanged.connect(self.apply_filters)
+        self.dateToEdit.dateTimeChanged.connect(self.apply_filters)
+        # новые события подтягиваются, пока окно открыто
+        self.tail_timer = QTimer(self)
+        self.tail_timer.timeout.connect(self.model.tail)
+
+    def apply_filters(self, *args):
+        start_ts = None
+        end_ts = None
+        if self.dateCheckBox.isChecked():
+            start_ts = self.dateFromEdit.dateTime().toMSecsSinceEpoch() / 1000
+            end_ts = self.dateToEdit.dateTime().toMSecsSinceEpoch() / 1000
+        self.model.set_filters(camera=self.cameraComboBox.currentData(),
+                               start_ts=start_ts, end_ts=end_ts)
+
+    def showEvent(self, event):
+        self.model.tail()
+        self.tail_timer.start(LOG_TAIL_PERIOD_MS)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.tail_timer.stop()
+        super().hideEvent(event)
+
     def returnToMain(self, event):
         self.close()
         self.destroy()
@@ -128,53 +159,96 @@ class SecondWindow(QWidget):
 
 
 class VideoWorker(Thread):
-    def __init__(self, name, videotool, videoview, mutex, stop_event):
+    def __init__(self, name, videotool, videoview, mutex, stop_event,
+                 display_fps=DISPLAY_MAX_FPS, analysis_fps=DEFAULTS['analysis_fps']):
         super().__init__(name=name)
         self.vtool = videotool
         self.vview = videoview
         self.mutex = mutex
         self.stop_event = stop_event
+        # показывать чаще, чем идёт поток, бессмысленно
+        if self.vtool.fps > 0:
+            display_fps = min(display_fps, self.vtool.fps)
+        self.display_period = 1 / display_fps
 
         self.emergency_stop = False
         self.last_frame = None
-        self.reader = Thread(target=self.read_stream, args=[stop_event])
-
-    def read_stream(self, stop_event):
-        print('{}: let\'s read the stream!'.format(self.getName()))
-        try:
-            while not stop_event.is_set() and not self.emergency_stop:
-                ret, self.last_frame = self.vtool.video.read()
-        except:
-            print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
-        print('{}: done!'.format(self.getName()))
+        self.reader = None  # поток, заполняющий frame_slot, если кадры не из CaptureHub
+        if self.vtool.source is None:
+            self.frame_slot = FrameSlot()  # кадры для показа
+        else:
+            self.frame_slot = self.vtool.source.subscribe(name=name)
+        self.analysis_slot = self.frame_slot  # кадры для анализа
+        if self.vtool.has_substream():
+            self.analysis_slot = self.vtool.sub_source.subscribe(name=name + 'Analysis')
+        self.analyzer = AnalysisWorker(name + 'Analysis', videotool, self.analysis_slot,
+                                       analysis_fps, stop_event,
+                                       count_stats=self.analysis_slot is not self.frame_slot)
+
+    # Пока основной поток не нужен, показ идёт из дополнительного,
+    # а основной источник только вычитывает кадры, не декодируя их
+    def get_display_slot(self):
+        if self.analysis_slot is self.frame_slot:
+            return self.frame_slot
+        is_main_needed = self.vtool.is_main_stream_needed()
+        self.frame_slot.is_active = is_main_needed
+        return self.frame_slot if is_main_needed else self.analysis_slot
 
     def run(self):
-        self.reader.start()
+        if self.reader is not None:
+            self.reader.start()
+        self.analyzer.start()
+        last_seqs = {self.frame_slot: 0, self.analysis_slot: 0}
+        next_display_time = time.monotonic()
         try:
             while not self.stop_event.is_set():
-                # time_start = datetime.now()
+                # не чаще display_fps
+                delay = next_display_time - time.monotonic()
+                if delay > 0 and self.stop_event.wait(delay):
+                    break
+                # ждём новый кадр, а не перерисовываем старый
+                slot = self.get_display_slot()
+                seq, frame = slot.get(last_seqs[slot], timeout=FRAME_WAIT_SEC)
+                if frame is None:
+                    if slot.is_closed:
+                        break
+                    continue
+                last_seqs[slot] = seq
+                next_display_time = time.monotonic() + self.display_period
+                self.last_frame = frame
+                time_start = time.perf_counter()
                 self.mutex.acquire()
-                if not self.stop_event.is_set() and self.last_frame is not None:
+                time_start = self.vtool.timers.observe_since('lock_wait', time_start)
+                if not self.stop_event.is_set():
                     self.tick()
+                    self.vtool.timers.observe_since('tick', time_start)
                 self.mutex.release()
-                # elapsed_ms = (datetime.now() - time_start).microseconds / 1000
-                # print(elapsed_ms, 'ms elapsed')
-                # time.sleep(max(0, self.vtool.freq_ms - elapsed_ms) / 1000)
-            print('It\'s {}, goodbye!'.format(self.getName()))
+            print('It\'s {}, goodbye! Frames: {}'.format(self.getName(), self.frame_slot.get_stats()))
         except:
             print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
             self.emergency_stop = True
             if self.mutex.locked():
                 self.mutex.release()
-        self.reader.join()
+        if self.reader is not None:
+            self.reader.join()
+        if self.vtool.source is not None:
+            self.vtool.source.unsubscribe(self.frame_slot)
+        if self.vtool.has_substream():
+            self.vtool.sub_source.unsubscribe(self.analysis_slot)
+        self.analyzer.join()
 
     # Действия, которые выполняются над каждым кадром
     def tick(self):
         if self.vtool.is_displayable() and self.vtool.is_playing:
-            container = self.vview.video_label_container
-
-            ratio_w = container.width() / self.vtool.frame_w
-            ratio_h = container.height() / self.vtool.frame_h
+            # размер виджета запоминается в его resizeEvent, сам виджет отсюда не трогаем
+            canvas_w, canvas_h = self.vview.video_canvas.get_size()
+            if self.vtool.frame_w <= 0 or self.vtool.frame_h <= 0:
+                # источник открылся не сразу и размер кадра заранее неизвестен
+                self.vtool.set_stream_info(self.vtool.fps, self.last_frame.shape[1],
+                                           self.last_frame.shape[0])
+
+            ratio_w = canvas_w / self.vtool.frame_w
+            ratio_h = canvas_h / self.vtool.frame_h
             ratio = min(ratio_w, ratio_h)
 
             if self.vtool.border_detector.is_drawing:
@@ -183,6 +257,8 @@ class VideoWorker(Thread):
                                              int(self.vtool.frame_h * ratio),
                                              mode=cameramode.ORIGINAL,
                                              bgr_to_rgb=False)
+                if frame is self.last_frame:
+                    frame = frame.copy()  # границы рисуются не на общем кадре
                 # frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                 cv2.imshow(self.vtool.border_detector.window_id,
                            self.vtool.border_detector.draw_regions(frame,
@@ -192,11 +268,20 @@ class VideoWorker(Thread):
                     print('qq!')
                     self.vview.borders_btn.click()"""
             else:
-                frame = self.vtool.get_frame(self.last_frame,
-                                             int(self.vtool.frame_w * ratio),
-                                             int(self.vtool.frame_h * ratio))
-                frame = get_image_qt(frame)
-                self.vview.video_label.setPixmap(frame)
+                width = int(self.vtool.frame_w * ratio)
+                height = int(self.vtool.frame_h * ratio)
+                if width <= 0 or height <= 0:
+                    return
+                self.vtool.display_size = (width, height)
+                # детекторы запускает AnalysisWorker, здесь только отрисовка.
+                # Кадр уходит в FrameCanvas, рисует его поток интерфейса
+                # кадр собирается прямо в свободном буфере FrameCanvas
+                buffer = self.vview.video_canvas.get_buffer((height, width, 3))
+                frame = self.vtool.get_frame(self.last_frame, width, height, analyze=False,
+                                             bgr_to_rgb=FrameCanvas.needs_rgb, dst=buffer)
+                time_start = time.perf_counter()
+                self.vview.video_canvas.publish(frame)
+                self.vtool.timers.observe_since('publish', time_start)
 
     def start(self):
         print('Hello, I\'m {}'.format(self.getName()))
@@ -204,77 +289,140 @@ class VideoWorker(Thread):
         super().start()
 
 
-class SecurityDetectorWorker(Thread):
-    def __init__(self, name, video_capture, object_detector,
-                 checking_period_sec, checking_burst, mutex, stop_event):
-        super().__init__(name=name)
-        self.video_capture = video_capture
-        self.object_detector = object_detector
-        self.checking_period_sec = checking_period_sec
-        self.checking_burst = checking_burst
-        self.mutex = mutex
-        self.stop_event = stop_event
+# Захват и анализ камеры идут в отдельном процессе (см. cameraprocess),
+# здесь кадры и результаты только забираются из общей памяти и рисуются
+class ProcessVideoWorker(VideoWorker):
+    def __init__(self, name, videotool, videoview, mutex, stop_event, camera_process,
+                 display_fps=DISPLAY_MAX_FPS, analysis_fps=DEFAULTS['analysis_fps']):
+        super().__init__(name, videotool, videoview, mutex, stop_event,
+                         display_fps=display_fps, analysis_fps=analysis_fps)
+        self.camera_process = camera_process
+        self.max_display_fps = display_fps
+        self.result_poll_period = 1 / analysis_fps
+        self.reader = Thread(target=self.read_shared_frames, args=[stop_event])
+        self.analyzer = Thread(target=self.read_shared_results, args=[stop_event])
 
-        self.security_prev_state = False
-        self.security_curr_state = False
-    
     def run(self):
+        self.vview.state_changed.emit(self.camera_process.get_state())
+        self.camera_process.start()
+        if not self.camera_process.wait_ready():
+            print('{}: camera process is not ready'.format(self.getName()))
+            self.camera_process.stop()
+            return
+        meta = self.camera_process.meta
+        self.vtool.set_stream_info(meta['fps'], meta['shape'][1], meta['shape'][0])
+        if meta['fps'] > 0:
+            self.display_period = 1 / min(self.max_display_fps, meta['fps'])
         try:
-            self.tick()
-            while not self.stop_event.is_set():
-                waiting_start_time = datetime.now()
-                while (datetime.now() - waiting_start_time).seconds < self.checking_period_sec:
-                    self.video_capture.read()
-                    if self.stop_event.is_set():
-                        break;
-                # time_start = datetime.now()
-                self.mutex.acquire()
-                if not self.stop_event.is_set():
-                    self.tick()
-                self.mutex.release()
-                # elapsed_ms = (datetime.now() - time_start).microseconds / 1000
-                # print(elapsed_ms, 'ms elapsed')
-                # time.sleep(max(0, self.vtool.freq_ms - elapsed_ms) / 1000)
-            print('It\'s {}, goodbye!'.format(self.getName()))
+            super().run()
+        finally:
+            self.camera_process.stop()
+
+    def read_shared_frames(self, stop_event):
+        last_seq = 0
+        state = None
+        try:
+            while not stop_event.is_set() and not self.emergency_stop:
+                if self.camera_process.get_state() != state:
+                    state = self.camera_process.get_state()
+                    self.vview.state_changed.emit(state)
+                seq, frame = self.camera_process.read_frame(last_seq, FRAME_WAIT_SEC)
+                if frame is not None:
+                    last_seq = seq
+                    self.frame_slot.put(frame)
+                    if self.vtool.recorder is not None:
+                        self.vtool.recorder.put(frame)
+                elif not self.camera_process.is_alive():
+                    break
         except:
             print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
-            if self.mutex.locked():
-                self.mutex.release()
+        finally:
+            self.frame_slot.close()
 
-    # Действия, которые выполняются над каждым кадром
-    def tick(self):
-        print('Let\'s check...')
-        self.security_prev_state = self.security_curr_state
-        self.security_curr_state = False
-        log_str = ''
-        for i in range(self.checking_burst):
-            if self.stop_event.is_set():
-                return
-
-            frame = self.video_capture.read()[1]
-            boxes, scores, classes = self.object_detector.process(frame)
-            if len(boxes) > 0:
-                self.security_curr_state = True
-                break
-
-        if self.security_curr_state != self.security_prev_state:
-            log_str = '{} - охранник {}'.format(datetime.now().\
-                    strftime('%d.%m.%y %H:%M'),\
-                    'на месте' if self.security_curr_state else 'отсутствует')
-
-        print('Log:', log_str)
-        if(log_str != ''):
-            with open('log.txt', 'a') as f:
-                f.write(log_str + '\r\n')
-
-    def start(self):
-        print('Hello, I\'m {}'.format(self.getName()))
-        super().start()
+    def read_shared_results(self, stop_event):
+        last_seq = 0
+        try:
+            while not stop_event.wait(self.result_poll_period) and not self.emergency_stop:
+                result = self.camera_process.read_result(last_seq)
+                if result is None:
+                    continue
+                last_seq, boxes, class_ids = result
+                # процесс камеры анализирует кадры в том же размере анализа
+                size = self.vtool.get_analysis_size(self.vtool.frame_w, self.vtool.frame_h)
+                if class_ids is None:
+                    self.vtool.set_motion_detections(boxes, size)
+                else:
+                    labels = self.vtool.object_detector.labels
+                    self.vtool.set_object_detections(boxes, [labels[c - 1] for c in class_ids], size)
+        except:
+            print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
 
+    def tick(self):
+        mode = self.vtool.mode
+        if self.vtool.border_detector.is_drawing or not self.vtool.is_playing:
+            mode = cameramode.ORIGINAL
+        self.camera_process.set_analysis(mode)
+        super().tick()
+
+
+# Камера в окне: её настройки, VideoTool и поток показа и анализа со своим
+# stop_event, чтобы камеры перезапускались независимо друг от друга
+class CameraPipeline:
+    def __init__(self, camera, vtool):
+        self.camera = camera
+        self.vtool = vtool
+        self.mutex = Lock()
+        self.stop_event = Event()
+        self.worker = None
+
+
+# Расположение count камер в сетке, близкой к квадратной:
+# (строка, столбец, ширина, высота). Последняя камера неполного
+# ряда растягивается на оставшиеся столбцы
+def get_grid_positions(count):
+    cols = max(1, math.ceil(math.sqrt(count)))
+    positions = [(i // cols + 1, i % cols + 1, 1, 1) for i in range(count)]
+    if count % cols != 0:
+        row, col, w, h = positions[-1]
+        positions[-1] = (row, col, cols - col + 1, h)
+    return positions
+
+
+# Камеры без файла конфигурации: 'files' - тестовые ролики, 'cameras' - камеры офиса
+def get_default_config(videosource):
+    if videosource == 'files':
+        cameras = [{'source': '../cat.mp4'},
+                   {'source': '../cat.mp4'},
+                   {'source': '../people.mp4'}]
+        security = {'source': '../people.mp4'}
+    else:
+        cameras = []
+        for address in ('192.168.1.203', '192.168.1.135', '192.168.1.163'):
+            url = 'rtsp://' + address + ':554/user=admin_password=tlJwpbo6_channel=1_stream={}.sdp?real_stream'
+            # stream=1 - дополнительный поток низкого разрешения для анализа
+            cameras.append({'source': url.format(0), 'substream': url.format(1)})
+        security = {'source': 0}
+    for camera in cameras:
+        camera['mode'] = 'original'
+    return parse_config({'cameras': cameras, 'security': security})
+
+
+# Первый аргумент *.json - файл конфигурации, без аргументов - CONFIG_PATH,
+# если он есть; иначе 'files'/'cameras' - встроенные наборы камер
+def get_config():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    path = None
+    if len(args) > 0 and args[0].endswith('.json'):
+        path = args[0]
+    elif len(args) == 0 and os.path.exists(CONFIG_PATH):
+        path = CONFIG_PATH
+    if path is not None:
+        return load_config(path), path
+    return get_default_config(args[0] if len(args) > 0 else 'cameras'), None
 
 
 class UI(QMainWindow, mainwindow.Ui_MainWindow):
-    def __init__(self):
+    def __init__(self, config, config_path=None):
         # Это здесь нужно для доступа к переменным, методам
         # и т.д. в файле design.py
         super().__init__()
@@ -283,150 +431,241 @@ class UI(QMainWindow, mainwindow.Ui_MainWindow):
         self.width_standard = 1200
         self.width360 = 1600
 
-        vsrcs = [None] * 4
-        secsrc = None
-        videosource = 'cameras'
-        if len(sys.argv) > 1:
-            videosource = sys.argv[1]
-
-        if (videosource == 'files'):
-            vsrcs[0] = '../cat.mp4'
-            vsrcs[1] = '../cat.mp4'
-            vsrcs[2] = '../people.mp4'
-            vsrcs[3] = '../people.mp4'
-            secsrc = '../people.mp4'
-        else:
-            vsrcs[0] = 'rtsp://192.168.1.203:554/user=admin_password=tlJwpbo6_channel=1_stream=0.sdp?real_stream'
-            vsrcs[1] = 'rtsp://192.168.1.135:554/user=admin_password=tlJwpbo6_channel=1_stream=0.sdp?real_stream'
-            vsrcs[2] = 'rtsp://192.168.1.163:554/user=admin_password=tlJwpbo6_channel=1_stream=0.sdp?real_stream'
-            vsrcs[3] = 0
-            secsrc = 0
-
-        vv_positions = [(1, 1, 1, 1),  # Позиции создаваемых VideoView в сетке
-                        (1, 2, 1, 1),  # (строка, столбец, ширина, высота)
-                        (2, 1, 2 if CAMERAS_COUNT == 3 else 1, 1),
-                        (2, 2, 1, 1)
-                       ]
-
-        model_name = 'nn_model'  # faster_rcnn_inception_v2_coco_2018_01_28
-        model_path = model_name + '/frozen_inference_graph.pb'
-        detection_graph = tf.Graph()
-        with detection_graph.as_default():
-            od_graph_def = tf.GraphDef()
-            with tf.gfile.GFile(model_path, 'rb') as fid:
-                serialized_graph = fid.read()
-                od_graph_def.ParseFromString(serialized_graph)
-                tf.import_graph_def(od_graph_def, name='')
-
-        labels = []
-        labels_path = 'classes_en.txt'  # HERE - файл с подписями для классов
-        with open(labels_path) as f:
-            labels = f.readlines()
-        labels = [s.strip() for s in labels]
-
-        # Инициализация инструментария для каждого видеопотока
-        self.videotools = []
-        self.videoviews = []
-        self.mutexes = []
-        self.stop_cam_threads_event = Event()
-        for i in range(CAMERAS_COUNT):
-            self.videotools.append(VideoTool(src=vsrcs[i], init_fc=i))
-            self.videotools[i].object_detector = ObjectDetector(detection_graph=detection_graph,
-                                                                labels=labels,
-                                                                classes_to_detect=CLASSES_TO_DETECT,
-                                                                confidence_level=CONFIDENCE_LEVEL)
-            self.videotools[i].border_detector = BorderDetector()
-            self.videotools[i].motion_detector = MotionDetector()
-
-            self.videoviews.append(VideoView(self, caption='Камера №'+str(i+1)))
-            row, col, w, h = vv_positions[i]
-            self.main_grid.addWidget(self.videoviews[i], row, col, h, w)
-
-            self.videoviews[i].mode_cb.currentIndexChanged.\
-                connect(self.videotools[i].set_mode)
-
-            def borders_slot(event, i=i):
-                vtool = self.videotools[i]
-                vview = self.videoviews[i]
-
-                self.mutexes[i].acquire()
-                if vtool.border_detector.is_drawing:
-                    vtool.border_detector.end_selecting_region()
-                    vtool.is_borders_mode = vtool.border_detector.has_regions
-                    vview.borders_btn.setText('Очистить границы'\
-                                              if vtool.is_borders_mode else\
-                                              'Обозначить границы')
-                else:
-                    if vtool.is_borders_mode:
-                        vtool.border_detector.clear_points()
-                        vtool.is_borders_mode = False
-                        vview.borders_btn.setText('Обозначить границы')
-                    else:
-                        vview.video_label.pixmap().fill(QColor(0, 0, 0))
-                        vtool.border_detector.start_selecting_region(\
-                            str(datetime.now()))
-                        vview.borders_btn.setText('Сохранить границы')
-                self.mutexes[i].release()
-
-            self.videoviews[i].borders_btn.clicked.connect(borders_slot)
-            self.mutexes.append(Lock())
-
-        self.security_capture = cv2.VideoCapture(secsrc)
-        self.security_detector = ObjectDetector(detection_graph=detection_graph,
-                                                labels=labels,
-                                                classes_to_detect=[1],  # person
-                                                confidence_level=CONFIDENCE_LEVEL)
+        # --processes: захват и анализ каждой камеры в отдельном процессе
+        self.is_process_mode = '--processes' in sys.argv
+        self.config = config
+        self.config_path = config_path  # None - камеры по умолчанию, перечитывать нечего
+
+        # События всех камер пишутся пачками из отдельного потока
+        self.event_store = EventStore(config['events_db'])
+        self.event_store.start()
+        self.camera_state_log = CameraStateLog(self.event_store)
+
+        # Каждый источник открывается и декодируется один раз,
+        # кадры раздаются всем, кто его читает
+        self.capture_hub = CaptureHub()
+        # Модель загружается один раз, детекторы всех камер делят общий пакетный инференс
+        self.factory = CameraFactory(config, self.capture_hub, self.event_store)
+        self.factory.start()
+        # Метрики конвейера для Prometheus, см. metrics.py
+        self.metrics_server = None
+        if config['metrics_port'] is not None:
+            self.metrics_server = MetricsServer(config['metrics_port'], config['metrics_host'])
+            self.metrics_server.start()
+
+        self.cameras = {}  # номер камеры -> CameraPipeline, в порядке конфигурации
+        self.videoviews = {}  # виджеты камер, переживают перезапуск камеры
+        self.player_windows = {}  # окна просмотра записей по номеру камеры
+        for camera in config['cameras']:
+            self.add_camera(camera)
+        self.update_layout()
+
+        self.security_source = None
+        self.security_detector = None
+        self.security_thread = None
         self.security_mutex = Lock()
         self.stop_security_event = Event()
+        self.create_security()
 
         self.setWindowTitle('Security System')
         self.log_btn.clicked.connect(self.log_open)
-        self.refresh_btn.clicked.connect(self.refresh_cameras)
-        self.refresh_btn.clicked.connect(self.refresh_security_cam)
+        self.refresh_btn.clicked.connect(self.refresh)
         self.settings_btn.clicked.connect(self.settings_open)
         self.exit_btn.clicked.connect(self.close)
         self.settings_window = None
         self.log_window = None
 
+        self.overlay_totals = {}  # номер камеры -> время этапов на прошлом обновлении
+        self.overlay_time = time.monotonic()
+        if config['metrics_overlay']:
+            self.overlay_timer = QTimer(self)
+            self.overlay_timer.timeout.connect(self.update_overlays)
+            self.overlay_timer.start(OVERLAY_PERIOD_MS)
+
+    # Создаёт камеру по её настройкам; поток камеры запускает start_camera
+    def add_camera(self, camera):
+        camera_id = camera['id']
+        vview = self.videoviews.get(camera_id)
+        if vview is None:
+            vview = self.create_videoview(camera_id)
+        vview.caption = camera['name']
+        # до create_videotool: уже работающий поток сразу сообщит своё состояние
+        vview.show_state(STATE_CONNECTING)
+        # в режиме процессов поток открывает процесс камеры
+        vtool = self.factory.create_videotool(camera, use_sources=not self.is_process_mode,
+                                              on_state=vview.state_changed.emit)
+        vtool.set_display_format(is_rgb=FrameCanvas.needs_rgb)
+        self.cameras[camera_id] = CameraPipeline(camera, vtool)
+        vview.mode_cb.setCurrentIndex(vtool.mode)
+        vview.borders_btn.setText('Очистить границы' if vtool.is_borders_mode else 'Обозначить границы')
+        vview.videos_btn.setEnabled(vtool.recorder is not None)
+
+    def create_videoview(self, camera_id):
+        vview = VideoView(self, caption='Камера №' + str(camera_id))
+        vview.state_changed.connect(
+            lambda state: self.camera_state_log.update(camera_id, state))
+        vview.mode_cb.currentIndexChanged.connect(
+            lambda mode: self.cameras[camera_id].vtool.set_mode(mode))
+        vview.borders_btn.clicked.connect(lambda event: self.borders_clicked(camera_id))
+        vview.videos_btn.clicked.connect(lambda event: self.videos_clicked(camera_id))
+        self.videoviews[camera_id] = vview
+        return vview
+
+    # Останавливает камеру и освобождает всё, что ей принадлежит.
+    # keep_view=True - виджет остаётся для камеры с теми же номером и местом
+    def remove_camera(self, camera_id, keep_view=False):
+        self.stop_camera(camera_id)
+        pipeline = self.cameras.pop(camera_id)
+        self.factory.release_videotool(pipeline.vtool)
+        player_window = self.player_windows.pop(camera_id, None)
+        if player_window is not None:
+            player_window.close()
+        if not keep_view:
+            pipeline.vtool.timers.release()
+            self.overlay_totals.pop(camera_id, None)
+            vview = self.videoviews.pop(camera_id)
+            self.main_grid.removeWidget(vview)
+            vview.deleteLater()
+
+    # Сетка пересчитывается при каждом изменении состава камер
+    def update_layout(self):
+        for vview in self.videoviews.values():
+            self.main_grid.removeWidget(vview)
+        for camera_id, (row, col, w, h) in zip(self.cameras, get_grid_positions(len(self.cameras))):
+            self.main_grid.addWidget(self.videoviews[camera_id], row, col, h, w)
+
+    def borders_clicked(self, camera_id):
+        pipeline = self.cameras[camera_id]
+        vtool = pipeline.vtool
+        vview = self.videoviews[camera_id]
+
+        pipeline.mutex.acquire()
+        if vtool.border_detector.is_drawing:
+            vtool.border_detector.end_selecting_region()
+            vtool.is_borders_mode = vtool.border_detector.has_regions
+            vview.borders_btn.setText('Очистить границы'\
+                                      if vtool.is_borders_mode else\
+                                      'Обозначить границы')
+        else:
+            if vtool.is_borders_mode:
+                vtool.border_detector.clear_points()
+                vtool.is_borders_mode = False
+                vview.borders_btn.setText('Обозначить границы')
+            else:
+                vview.video_canvas.clear()
+                vtool.border_detector.start_selecting_region(\
+                    str(datetime.now()), vtool.display_size)
+                vview.borders_btn.setText('Сохранить границы')
+        pipeline.mutex.release()
+
+    def videos_clicked(self, camera_id):
+        if camera_id not in self.player_windows:
+            self.player_windows[camera_id] = VideoPlayerWindow(self.cameras[camera_id].vtool.recorder.store,
+                                                               self.videoviews[camera_id].caption)
+        self.player_windows[camera_id].show()
+        self.player_windows[camera_id].activateWindow()
+
+    # Запускает обработку видеопотока камеры в отдельном потоке выполнения
+    def start_camera(self, camera_id):
+        pipeline = self.cameras[camera_id]
+        camera = pipeline.camera
+        pipeline.stop_event.clear()
+        name = 'VideoWorker' + str(camera_id)
+        if self.is_process_mode:
+            camera_process = CameraProcess('CameraProcess' + str(camera_id), camera['source'],
+                                           self.get_camera_process_options(camera))
+            pipeline.worker = ProcessVideoWorker(name, pipeline.vtool, self.videoviews[camera_id],
+                                                 pipeline.mutex, pipeline.stop_event, camera_process,
+                                                 display_fps=self.get_display_fps(),
+                                                 analysis_fps=camera['analysis_fps'])
+        else:
+            pipeline.worker = VideoWorker(name, pipeline.vtool, self.videoviews[camera_id],
+                                          pipeline.mutex, pipeline.stop_event,
+                                          display_fps=self.get_display_fps(),
+                                          analysis_fps=camera['analysis_fps'])
+        pipeline.worker.start()
+
+    def stop_camera(self, camera_id):
+        pipeline = self.cameras[camera_id]
+        pipeline.stop_event.set()
+        if pipeline.worker is not None:
+            pipeline.worker.join()
+            print('Goodbye, {}!'.format(pipeline.worker.getName()))
+            pipeline.worker = None
+
     # Запускает обработку всех видеопотоков в отдельных потоках выполнения
     def start_cam_threads(self):
-        self.cam_threads = []
-        for i in range(CAMERAS_COUNT):
-            self.cam_threads.append(VideoWorker('VideoWorker' + str(i),
-                                                self.videotools[i],
-                                                self.videoviews[i],
-                                                self.mutexes[i],
-                                                self.stop_cam_threads_event))
-            self.cam_threads[i].start()
+        for camera_id in self.cameras:
+            self.start_camera(camera_id)
+
+    # Параметры анализа для процесса камеры (передаются при запуске процесса)
+    def get_camera_process_options(self, camera):
+        return {'process_period': TRACKED_PROCESS_PERIOD,
+                'analysis_fps': camera['analysis_fps'],
+                'analysis_size': camera['analysis_size'],
+                'model_path': self.config['model_path'],
+                'labels': self.factory.labels,
+                'classes_to_detect': camera['classes_to_detect'],
+                'confidence_level': camera['confidence_level'],
+                'intra_op_threads': self.config['tf_intra_op_threads'],
+                'inter_op_threads': self.config['tf_inter_op_threads']}
+
+    # Не чаще, чем обновляется экран
+    def get_display_fps(self):
+        screen = QApplication.primaryScreen()
+        if screen is not None and screen.refreshRate() > 0:
+            return min(DISPLAY_MAX_FPS, screen.refreshRate())
+        return DISPLAY_MAX_FPS
+
+    # Запись событий идёт всё время работы, перезапуск потоков камер её не прерывает
+    def start_recorders(self):
+        for pipeline in self.cameras.values():
+            if pipeline.vtool.recorder is not None:
+                pipeline.vtool.recorder.start()
+
+    def create_security(self):
+        security = self.config['security']
+        if security is None:
+            return
+        self.security_source = self.capture_hub.get_source(security['source'])
+        self.security_detector = self.factory.create_object_detector([1],  # person
+                                                                     self.config['confidence_level'])
+
+    def release_security(self):
+        if self.security_detector is not None:
+            self.security_detector.close()
+            self.capture_hub.release(self.security_source)
+        self.security_source = None
+        self.security_detector = None
 
     def start_security_thread(self):
+        security = self.config['security']
+        if security is None:
+            return
+        self.stop_security_event.clear()
         self.security_thread = SecurityDetectorWorker(name='SecurityDetector',
-                                                      video_capture=self.security_capture,
+                                                      source=self.security_source,
                                                       object_detector=self.security_detector,
-                                                      checking_period_sec=10,
-                                                      checking_burst=5,
+                                                      checking_period_sec=security['period_sec'],
+                                                      checking_burst=security['burst'],
                                                       mutex=self.security_mutex,
-                                                      stop_event=self.stop_security_event)
+                                                      stop_event=self.stop_security_event,
+                                                      event_store=self.event_store,
+                                                      camera_id=security['camera_id'])
         self.security_thread.start()
 
-    # Сообщает всем отдельным потокам выполнения, что обработка больше не нужна
-    def stop_cam_threads(self):
-        self.stop_cam_threads_event.set()
-
-    def stop_security_thread(self):
-        self.stop_security_event.set()
-
     def stop_cam_threads_and_wait(self):
-        self.stop_cam_threads()
-        for i in range(CAMERAS_COUNT):
-            self.cam_threads[i].join()
-            print('Goodbye, {}!'.format(self.cam_threads[i].getName()))
+        for camera_id in self.cameras:
+            self.stop_camera(camera_id)
         print('All camera threads are stopped')
 
     def stop_security_thread_and_wait(self):
-        self.stop_security_thread()
+        if self.security_thread is None:
+            return
+        self.stop_security_event.set()
         self.security_thread.join()
         print('Goodbye, {}!'.format(self.security_thread.getName()))
+        self.security_thread = None
 
     def settings_open(self, event):
         #print("it's realy settingsButton")
@@ -436,20 +675,102 @@ class UI(QMainWindow, mainwindow.Ui_MainWindow):
 
     def log_open(self, event):
         if not self.log_window:
-            self.log_window = LogWindow()
+            camera_ids = set(self.cameras)
+            if self.config['security'] is not None:
+                camera_ids.add(self.config['security']['camera_id'])
+            self.log_window = LogWindow(self.event_store, sorted(camera_ids))
         self.log_window.show()
-        with open("log.txt", 'r') as f:
-            mytext = f.read()
-            self.log_window.textEdit.setPlainText(mytext)
+
+    # Перечитывает файл конфигурации. Перезапускаются только камеры, настройки
+    # которых изменились, добавленные запускаются, убранные останавливаются,
+    # остальные продолжают работать. Если ничего не изменилось - все камеры
+    # и охрана перезапускаются, как раньше. Общие настройки (модель, журнал,
+    # записи) применяются только при следующем запуске программы
+    def refresh(self, event=None):
+        if self.config_path is None:
+            self.refresh_cameras()
+            self.refresh_security_cam()
+            return
+        try:
+            config = load_config(self.config_path)
+        except (OSError, ValueError) as e:
+            print('Config {} is not applied: {}'.format(self.config_path, e))
+            return
+        old = {camera['id']: camera for camera in self.config['cameras']}
+        new = {camera['id']: camera for camera in config['cameras']}
+        removed = [camera_id for camera_id in old if camera_id not in new]
+        changed = [camera_id for camera_id in old if camera_id in new and new[camera_id] != old[camera_id]]
+        added = [camera_id for camera_id in new if camera_id not in old]
+        is_security_changed = config['security'] != self.config['security']
+        if len(removed) + len(changed) + len(added) == 0 and not is_security_changed:
+            self.refresh_cameras()
+            self.refresh_security_cam()
+            return
+
+        for camera_id in removed:
+            self.remove_camera(camera_id)
+        for camera_id in changed:
+            self.remove_camera(camera_id, keep_view=True)
+        self.config = dict(self.config, cameras=config['cameras'], security=config['security'])
+        for camera_id in changed + added:
+            self.add_camera(new[camera_id])
+        self.cameras = {camera_id: self.cameras[camera_id] for camera_id in new}
+        self.update_layout()
+        for camera_id in changed + added:
+            if self.cameras[camera_id].vtool.recorder is not None:
+                self.cameras[camera_id].vtool.recorder.start()
+            self.start_camera(camera_id)
+
+        if is_security_changed:
+            self.stop_security_thread_and_wait()
+            self.release_security()
+            self.create_security()
+            self.start_security_thread()
+        if self.log_window is not None:
+            self.log_window.close()  # список камер в фильтре устарел
+            self.log_window = None
+        print('Config {} applied: cameras added {}, changed {}, removed {}{}'.format(
+            self.config_path, added, changed, removed, ', security changed' if is_security_changed else ''))
+
+    # Средние времена этапов каждой камеры за время с прошлого обновления
+    def update_overlays(self):
+        now = time.monotonic()
+        period = max(now - self.overlay_time, 1e-3)
+        self.overlay_time = now
+        for camera_id, pipeline in self.cameras.items():
+            totals = pipeline.vtool.timers.get_totals()
+            prev_totals = self.overlay_totals.get(camera_id, {})
+            self.overlay_totals[camera_id] = totals
+
+            def get_mean_ms(stage):
+                total_sec, count = totals.get(stage, (0, 0))
+                prev_sec, prev_count = prev_totals.get(stage, (0, 0))
+                if count <= prev_count:
+                    return None, 0
+                return (total_sec - prev_sec) / (count - prev_count) * 1000, count - prev_count
+
+            def format_stages(stages):
+                parts = []
+                for stage in stages:
+                    mean_ms = get_mean_ms(stage)[0]
+                    if mean_ms is not None:
+                        parts.append('{} {:.1f}'.format(stage, mean_ms))
+                return ' | '.join(parts) + ' мс' if len(parts) > 0 else '-'
+
+            dropped = 0
+            if pipeline.worker is not None:
+                dropped = pipeline.worker.frame_slot.get_stats()['dropped']
+            text = 'показ {:.1f} к/с, потеряно {}: {}\nанализ {:.1f} к/с: {}'.format(
+                get_mean_ms('tick')[1] / period, dropped, format_stages(OVERLAY_DISPLAY_STAGES),
+                get_mean_ms('analyze')[1] / period, format_stages(OVERLAY_ANALYSIS_STAGES))
+            self.videoviews[camera_id].set_overlay_text(text)
 
     def refresh_cameras(self):
         self.stop_cam_threads_and_wait()
-        self.stop_cam_threads_event.clear()
         self.start_cam_threads()
 
     def refresh_security_cam(self):
         self.stop_security_thread_and_wait()
-        self.stop_security_event.clear()
         self.start_security_thread()
 
     def closeEvent(self, event):
@@ -457,18 +778,15 @@ class UI(QMainWindow, mainwindow.Ui_MainWindow):
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
             self.stop_cam_threads_and_wait()
-            self.stop_cam_threads_event.clear()
-            for i in range(CAMERAS_COUNT):
-                # self.mutexes[i].acquire()
-                # self.cam_threads[i].stop_gracefully()
-                self.videotools[i].close()
-                # self.mutexes[i].release()
-
             self.stop_security_thread_and_wait()
-            self.stop_cam_threads_event.clear()
-            self.security_capture.release()
-            if len(self.videotools) > 0:
-                self.videotools[0].object_detector.close()
+            for pipeline in self.cameras.values():
+                self.factory.release_videotool(pipeline.vtool)
+            self.release_security()
+            self.capture_hub.close()
+            self.factory.close()
+            self.event_store.close()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
             event.accept()
         else:
             event.ignore()
@@ -477,14 +795,18 @@ def main():
     app = QApplication(sys.argv)  # Новый экземпляр QApplication
     splash = Splash()
     splash.show()
-    window = UI()  # Создаём объект класса ExampleApp
-    window.videotools[0].object_detector.process(np.zeros((1, 1, 3)))
+    window = UI(*get_config())  # Создаём объект класса ExampleApp
+    # первый запуск сети долгий - делаем его до показа окна
+    pipeline = next(iter(window.cameras.values()), None)
+    if pipeline is not None:
+        pipeline.vtool.object_detector.process(np.zeros((1, 1, 3)))
     #window.setWindowOpacity(0.5)
     # pal = window.palette()
     # pal.setBrush(QPalette.Normal, QPalette.Background,
     #              QBrush(QPixmap("resources/Fone.jpg")))
     # window.setPalette(pal)
     # window.setAutoFillBackground(True)
+    window.start_recorders()
     window.start_cam_threads()
     window.start_security_thread()
     time.sleep(2)
@@ -494,4 +816,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
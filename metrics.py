@@ -0,0 +1,210 @@
+import bisect
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+# Метрики конвейера в текстовом формате Prometheus. Время этапов копится
+# в гистограммах с постоянными корзинами: наблюдение - поиск корзины
+# и три сложения, перцентили считает уже сам Prometheus. Счётчики кадров
+# и глубины очередей не ведутся отдельно, а читаются из уже существующей
+# статистики (get_stats) в момент запроса
+
+PREFIX = 'securitysystem_'
+# Границы корзин времени этапов, секунды
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+STAGE_METRIC = 'stage_seconds'
+STAGE_HELP = 'Time spent in a pipeline stage'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_PATH = '/metrics'
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                           .replace('\n', '\\n'))
+                          for key, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class Histogram:
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - больше всех границ
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    # Время от start (time.perf_counter) до сейчас. Возвращает текущее время,
+    # чтобы следующий этап отсчитывался от конца предыдущего
+    def observe_since(self, start):
+        now = time.perf_counter()
+        self.observe(now - start)
+        return now
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+
+# Гистограммы этапов одного потока обработки (камеры, охраны), создаются
+# при первом наблюдении этапа. Перезапущенная камера с теми же метками
+# продолжает те же гистограммы. registry = None - метрики никуда не выводятся
+class StageTimers:
+    def __init__(self, registry=None, **labels):
+        self.registry = registry
+        self.labels = labels
+        self.histograms = {}
+
+    def get(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            if self.registry is None:
+                histogram = Histogram()
+            else:
+                histogram = self.registry.histogram(STAGE_METRIC, STAGE_HELP, stage=stage, **self.labels)
+            self.histograms[stage] = histogram
+        return histogram
+
+    def observe_since(self, stage, start):
+        return self.get(stage).observe_since(start)
+
+    def release(self):
+        if self.registry is not None:
+            for histogram in list(self.histograms.values()):
+                self.registry.remove(histogram)
+        self.histograms = {}
+
+    # {этап: (сумма секунд, число наблюдений)} - для средних за период
+    def get_totals(self):
+        return {stage: histogram.snapshot()[1:] for stage, histogram in list(self.histograms.items())}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = {}  # (имя, метки) -> Histogram
+        self.helps = {}  # имя -> описание
+        self.collectors = []  # func() -> [(имя, тип, описание, {метки}, значение)]
+
+    def histogram(self, name, help_text, buckets=TIME_BUCKETS, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(buckets)
+                self.histograms[key] = histogram
+                self.helps[name] = help_text
+            return histogram
+
+    def stage_timers(self, **labels):
+        return StageTimers(self, **labels)
+
+    # Гистограмма больше не выводится (например, камеру убрали из конфигурации)
+    def remove(self, histogram):
+        with self.lock:
+            for key in [key for key, value in self.histograms.items() if value is histogram]:
+                del self.histograms[key]
+
+    def add_collector(self, func):
+        with self.lock:
+            self.collectors.append(func)
+
+    def remove_collector(self, func):
+        with self.lock:
+            if func in self.collectors:
+                self.collectors.remove(func)
+
+    def render(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            helps = dict(self.helps)
+            collectors = list(self.collectors)
+        lines = []
+        name = None
+        for (hist_name, labels), histogram in histograms:
+            if hist_name != name:
+                name = hist_name
+                lines.append('# HELP {}{} {}'.format(PREFIX, name, helps[name]))
+                lines.append('# TYPE {}{} histogram'.format(PREFIX, name))
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append('{}{}_bucket{} {}'.format(PREFIX, name,
+                                                       format_labels(labels + (('le', format_value(bound)),)),
+                                                       cumulative))
+            lines.append('{}{}_sum{} {}'.format(PREFIX, name, format_labels(labels), repr(total)))
+            lines.append('{}{}_count{} {}'.format(PREFIX, name, format_labels(labels), count))
+
+        # одинаковые ряды (например, два окна одного источника) складываются
+        samples = {}  # имя -> (тип, описание, {метки: значение})
+        for func in collectors:
+            try:
+                for sample_name, kind, help_text, labels, value in func():
+                    values = samples.setdefault(sample_name, (kind, help_text, {}))[2]
+                    key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+                    values[key] = values.get(key, 0) + value
+            except Exception:
+                print('Metrics collector error: {}'.format(traceback.format_exc()))
+        for sample_name, (kind, help_text, values) in sorted(samples.items()):
+            lines.append('# HELP {}{} {}'.format(PREFIX, sample_name, help_text))
+            lines.append('# TYPE {}{} {}'.format(PREFIX, sample_name, kind))
+            for labels, value in sorted(values.items()):
+                lines.append('{}{}{} {}'.format(PREFIX, sample_name, format_labels(labels),
+                                                format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()  # общий для всего процесса
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # каждый опрос в консоль не пишем
+
+
+# Отдаёт REGISTRY по http://host:port/metrics. По умолчанию слушает только
+# локальный адрес: метрики предназначены для Prometheus на той же машине
+class MetricsServer(Thread):
+    def __init__(self, port, host='127.0.0.1', registry=REGISTRY):
+        super().__init__(name='MetricsServer', daemon=True)
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+
+    def run(self):
+        print('Metrics: http://{}:{}{}'.format(*self.httpd.server_address[:2], METRICS_PATH))
+        self.httpd.serve_forever()
+
+    def stop(self):
+        if self.is_alive():
+            self.httpd.shutdown()
+            self.join()
+        self.httpd.server_close()
@@ -0,0 +1,157 @@
+import time
+import traceback
+from collections import deque
+from threading import Thread, Event
+
+import cv2
+
+from frameslot import FrameQueue
+from capturehub import POLICY_QUEUE
+from recordstore import FLAG_EVENT, FLAG_EVENT_START
+
+PREROLL_SEC = 5  # сколько секунд до события попадает в запись
+PREROLL_MAX_BYTES = 16 * 1024 * 1024  # предел памяти под предзапись одной камеры
+TAIL_SEC = 5  # сколько ещё писать после последнего срабатывания
+RECORD_FPS = 10  # частота кадров записи
+JPEG_QUALITY = 80
+QUEUE_LEN = 8  # несжатых кадров в очереди на сжатие, старые теряются
+FRAME_WAIT_SEC = 0.1
+
+
+# Запись по событиям. Кадры сжимаются в JPEG и держатся в кольце предзаписи,
+# ограниченном по времени и по объёму. По trigger кольцо сбрасывается в RecordStore
+# и запись идёт, пока срабатывания не прекратятся плюс tail_sec.
+# Сжатие и запись на диск - в потоке записи, а не в потоках захвата и показа.
+# Хранилище пишет JPEG-кадры как есть, перекодировать кольцо не нужно.
+# Если у камеры есть дополнительный поток, предзапись идёт из него, а основной
+# декодируется для записи только во время события
+class EventRecorder(Thread):
+    def __init__(self, name, store, preroll_sec=PREROLL_SEC, max_preroll_bytes=PREROLL_MAX_BYTES,
+                 tail_sec=TAIL_SEC, record_fps=RECORD_FPS, jpeg_quality=JPEG_QUALITY):
+        super().__init__(name=name, daemon=True)
+        self.store = store
+        self.preroll_sec = preroll_sec
+        self.max_preroll_bytes = max_preroll_bytes
+        self.tail_sec = tail_sec
+        self.frame_period = 1 / record_fps
+        self.jpeg_quality = jpeg_quality
+
+        self.source = None
+        self.preroll_source = None
+        self.frames = FrameQueue(QUEUE_LEN)  # заменяется подпиской в set_source
+        self.preroll_frames = self.frames  # кадры вне события
+        self.stop_event = Event()
+        self.preroll = deque()  # (время по monotonic, время epoch, JPEG)
+        self.preroll_bytes = 0
+        self.last_trigger_time = None
+        self.is_event = False  # сейчас идёт запись события
+        self.events = 0  # сколько записано событий
+
+    # Кадры из CaptureHub; без источника кадры передаются через put.
+    # preroll_source - дополнительный поток камеры для предзаписи
+    def set_source(self, source, preroll_source=None):
+        self.source = source
+        self.frames = source.subscribe(policy=POLICY_QUEUE, maxlen=QUEUE_LEN,
+                                       active=preroll_source is None, name=self.getName())
+        self.preroll_frames = self.frames
+        if preroll_source is not None:
+            self.preroll_source = preroll_source
+            self.preroll_frames = preroll_source.subscribe(policy=POLICY_QUEUE, maxlen=QUEUE_LEN,
+                                                           name=self.getName() + 'Preroll')
+
+    def put(self, frame):
+        self.frames.put(frame)
+
+    # Можно вызывать из любого потока (обычно из потока анализа)
+    def trigger(self):
+        self.last_trigger_time = time.monotonic()
+
+    def is_recording(self):
+        return self.is_event
+
+    def run(self):
+        print('{}: recording to {}'.format(self.getName(), self.store.path))
+        last_seq = 0
+        next_time = 0
+        try:
+            while not self.stop_event.is_set():
+                slot = self.frames if self.is_event else self.preroll_frames
+                seq, frame = slot.get(last_seq, timeout=FRAME_WAIT_SEC)
+                now = time.monotonic()
+                if frame is None:
+                    if slot.is_closed:
+                        break
+                    if self.is_event and self.is_tail_over(now):
+                        self.finish_event()
+                    continue
+                last_seq = seq
+                if now < next_time:
+                    continue  # не чаще record_fps
+                next_time = now + self.frame_period
+                ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if ok:
+                    self.add_frame(now, time.time(), jpeg.tobytes())
+        except:
+            print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
+        finally:
+            self.finish_event()
+            self.store.close()
+            self.unsubscribe()
+        print('{}: done! Events: {}'.format(self.getName(), self.events))
+
+    def is_tail_over(self, now):
+        return self.last_trigger_time is None or now - self.last_trigger_time > self.tail_sec
+
+    def add_frame(self, now, ts, jpeg):
+        if self.is_event and self.is_tail_over(now):
+            self.finish_event()
+        if self.is_event:
+            self.store.write(ts, jpeg, FLAG_EVENT)
+            return
+        if not self.is_tail_over(now):
+            self.start_event()
+            self.store.write(ts, jpeg, FLAG_EVENT | FLAG_EVENT_START)
+            return
+        self.preroll.append((now, ts, jpeg))
+        self.preroll_bytes += len(jpeg)
+        while len(self.preroll) > 0 and (self.preroll_bytes > self.max_preroll_bytes or
+                                         now - self.preroll[0][0] > self.preroll_sec):
+            self.preroll_bytes -= len(self.preroll.popleft()[2])
+
+    def start_event(self):
+        for _, ts, jpeg in self.preroll:
+            self.store.write(ts, jpeg)
+        self.preroll.clear()
+        self.preroll_bytes = 0
+        self.is_event = True
+        self.frames.is_active = True
+        if self.frames is not self.preroll_frames:
+            # во время события предзапись не читается: иначе после него
+            # в кольцо попали бы старые кадры с текущим временем
+            self.preroll_frames.is_active = False
+            self.preroll_frames.clear()
+        print('{}: event recording started'.format(self.getName()))
+
+    def finish_event(self):
+        if not self.is_event:
+            return
+        self.is_event = False
+        if self.frames is not self.preroll_frames:
+            self.frames.is_active = False
+            self.frames.clear()
+            self.preroll_frames.is_active = True
+        self.events += 1
+        print('{}: event recording finished'.format(self.getName()))
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        else:
+            self.unsubscribe()  # поток записи так и не запускался
+
+    def unsubscribe(self):
+        if self.source is not None:
+            self.source.unsubscribe(self.frames)
+        if self.preroll_source is not None:
+            self.preroll_source.unsubscribe(self.preroll_frames)
@@ -0,0 +1,205 @@
+import bisect
+import os
+from threading import Lock
+
+import numpy as np
+
+SEGMENT_SEC = 300  # длина сегмента записи
+QUOTA_BYTES = 20 * 1024 ** 3  # сколько места может занимать запись одной камеры
+
+# Запись индекса: время кадра (секунды epoch), смещение и размер JPEG
+# в файле данных сегмента, флаги
+INDEX_DTYPE = np.dtype([('ts', '<f8'), ('offset', '<i8'), ('size', '<i4'), ('flags', '<i4')])
+FLAG_EVENT = 1  # кадр записан во время события (не предзапись)
+FLAG_EVENT_START = 2  # кадр, на котором событие началось
+
+DATA_EXT = '.mjpeg'
+INDEX_EXT = '.idx'
+
+
+# Запись камеры, разбитая на сегменты фиксированной длины. Сегмент - пара файлов
+# <начало в мс>.mjpeg (склеенные JPEG-кадры) и <начало в мс>.idx (INDEX_DTYPE
+# на каждый кадр). Поиск по времени: двоичный поиск по началам сегментов,
+# затем searchsorted по отображённому в память индексу одного сегмента -
+# файлы данных при этом не читаются. Старые сегменты удаляются по квоте
+class RecordStore:
+    def __init__(self, path, segment_sec=SEGMENT_SEC, quota_bytes=QUOTA_BYTES):
+        self.path = path
+        self.segment_sec = segment_sec
+        self.quota_bytes = quota_bytes
+        self.lock = Lock()
+        os.makedirs(path, exist_ok=True)
+
+        self.segments = []  # начала сегментов в мс, по возрастанию
+        self.segment_bytes = {}
+        for name in os.listdir(path):
+            base, ext = os.path.splitext(name)
+            if ext == INDEX_EXT and base.isdigit():
+                self.segments.append(int(base))
+        self.segments.sort()
+        for segment in self.segments:
+            self.segment_bytes[segment] = self.get_segment_size(segment)
+        self.total_bytes = sum(self.segment_bytes.values())
+
+        self.current = None  # сегмент, в который сейчас идёт запись
+        self.data_file = None
+        self.index_file = None
+        self.last_ts = 0.0
+
+        self.read_segment = None  # сегмент, который сейчас воспроизводится
+        self.read_index = None  # копия его индекса, см. get_read_index
+
+    def get_data_path(self, segment):
+        return os.path.join(self.path, str(segment) + DATA_EXT)
+
+    def get_index_path(self, segment):
+        return os.path.join(self.path, str(segment) + INDEX_EXT)
+
+    def get_segment_size(self, segment):
+        size = 0
+        for path in (self.get_data_path(segment), self.get_index_path(segment)):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    # ---- запись (из одного потока, EventRecorder) ----
+
+    def write(self, ts, jpeg, flags=0):
+        ts = max(ts, self.last_ts)  # часы могли сдвинуться назад, индекс должен быть упорядочен
+        self.last_ts = ts
+        if self.current is None or ts * 1000 - self.current >= self.segment_sec * 1000:
+            self.start_segment(int(ts * 1000))
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record['ts'] = ts
+        record['offset'] = self.data_file.tell()
+        record['size'] = len(jpeg)
+        record['flags'] = flags
+        self.data_file.write(jpeg)
+        self.index_file.write(record.tobytes())
+        # индекс читается окном просмотра, пока сегмент ещё пишется
+        self.data_file.flush()
+        self.index_file.flush()
+        with self.lock:
+            added = len(jpeg) + INDEX_DTYPE.itemsize
+            self.segment_bytes[self.current] += added
+            self.total_bytes += added
+
+    def start_segment(self, segment):
+        self.close()
+        if len(self.segments) > 0 and segment <= self.segments[-1]:
+            segment = self.segments[-1] + 1
+        self.data_file = open(self.get_data_path(segment), 'ab')
+        self.index_file = open(self.get_index_path(segment), 'ab')
+        with self.lock:
+            self.segments.append(segment)
+            self.segment_bytes[segment] = 0
+            self.current = segment
+        self.enforce_quota()
+
+    # Удаляет самые старые сегменты, пока запись не уложится в квоту
+    def enforce_quota(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.quota_bytes or len(self.segments) <= 1:
+                    return
+                segment = self.segments.pop(0)
+                self.total_bytes -= self.segment_bytes.pop(segment, 0)
+            for path in (self.get_data_path(segment), self.get_index_path(segment)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            print('{}: segment {} removed by quota'.format(self.path, segment))
+
+    def close(self):
+        for f in (self.data_file, self.index_file):
+            if f is not None:
+                f.close()
+        self.data_file = None
+        self.index_file = None
+        self.current = None
+
+    # ---- чтение (окно просмотра) ----
+
+    def get_segments(self):
+        with self.lock:
+            return list(self.segments)
+
+    # Индекс сегмента, отображённый в память; None, если сегмент пуст или удалён
+    def load_index(self, segment):
+        path = self.get_index_path(segment)
+        try:
+            count = os.path.getsize(path) // INDEX_DTYPE.itemsize
+        except OSError:
+            return None
+        if count == 0:
+            return None
+        # последняя запись может дописываться прямо сейчас - берём только целые
+        return np.memmap(path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+
+    # Индекс сегмента для покадрового чтения. Перечитывается, только когда
+    # чтение переходит в другой сегмент или за конец прочитанной части
+    # (сегмент ещё дописывается). Хранится копия, а не memmap: открытый
+    # файл не дал бы удалить сегмент по квоте
+    def get_read_index(self, segment, pos=0):
+        if segment != self.read_segment or self.read_index is None or pos >= len(self.read_index):
+            index = self.load_index(segment)
+            self.read_segment = segment
+            self.read_index = None if index is None else np.array(index)
+        return self.read_index
+
+    # Позиция (сегмент, номер кадра) первого кадра не раньше ts,
+    # либо None, если позже ts записей нет
+    def seek(self, ts):
+        segments = self.get_segments()
+        i = max(0, bisect.bisect_right(segments, int(ts * 1000)) - 1)
+        for segment in segments[i:]:
+            index = self.load_index(segment)
+            if index is None:
+                continue
+            pos = int(np.searchsorted(index['ts'], ts, side='left'))
+            if pos < len(index):
+                return segment, pos
+        return None
+
+    # Позиция кадра, следующего за (segment, pos), либо None
+    def next_position(self, segment, pos):
+        index = self.get_read_index(segment, pos + 1)
+        if index is not None and pos + 1 < len(index):
+            return segment, pos + 1
+        segments = self.get_segments()
+        for next_segment in segments[bisect.bisect_right(segments, segment):]:
+            if self.get_read_index(next_segment) is not None:
+                return next_segment, 0
+        return None
+
+    # Возвращает (ts, JPEG, flags) или None, если сегмент уже удалён
+    def read_frame(self, segment, pos):
+        index = self.get_read_index(segment, pos)
+        if index is None or pos >= len(index):
+            return None
+        record = index[pos]
+        try:
+            with open(self.get_data_path(segment), 'rb') as f:
+                f.seek(int(record['offset']))
+                jpeg = f.read(int(record['size']))
+        except OSError:
+            return None
+        return float(record['ts']), jpeg, int(record['flags'])
+
+    # Начала событий в интервале [start_ts, end_ts): просматриваются
+    # только индексы сегментов, попадающих в интервал
+    def find_events(self, start_ts, end_ts):
+        segments = self.get_segments()
+        i = max(0, bisect.bisect_right(segments, int(start_ts * 1000)) - 1)
+        j = bisect.bisect_left(segments, int(end_ts * 1000))
+        events = []
+        for segment in segments[i:j]:
+            index = self.load_index(segment)
+            if index is None:
+                continue
+            starts = index['ts'][(index['flags'] & FLAG_EVENT_START) != 0]
+            events.extend(float(t) for t in starts if start_ts <= t < end_ts)
+        return events
@@ -0,0 +1,137 @@
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+MAX_FRAME_DELAY_MS = 1000  # разрывы между событиями при воспроизведении не ждём
+EVENT_SEARCH_STEP_SEC = 24 * 3600  # события ищутся по суткам,
+EVENT_SEARCH_DAYS = 30             # не дальше стольких суток
+
+
+# Окно просмотра записей одной камеры (RecordStore): переход к любому
+# моменту, воспроизведение, переход к предыдущему и следующему событию
+class VideoPlayerWindow(QWidget):
+    def __init__(self, store, caption, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.store = store
+        self.position = None  # (сегмент, номер кадра)
+        self.current_ts = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.play_next)
+        self.setWindowTitle('Записи - ' + caption)
+        self.build()
+
+    def build(self):
+        self.main_layout = QVBoxLayout(self)
+        self.video_label = QLabel(self)
+        self.video_label.setMinimumSize(320, 240)
+        self.video_label.setAlignment(Qt.AlignCenter)
+        self.video_label.setStyleSheet('background: black; color: #F0F8FD;')
+        self.main_layout.addWidget(self.video_label)
+        self.time_label = QLabel(self)
+        self.main_layout.addWidget(self.time_label)
+
+        self.seek_layout = QHBoxLayout()
+        self.datetime_edit = QDateTimeEdit(QDateTime.currentDateTime(), self)
+        self.datetime_edit.setCalendarPopup(True)
+        self.datetime_edit.setDisplayFormat('dd.MM.yy HH:mm:ss')
+        self.seek_layout.addWidget(self.datetime_edit)
+        self.go_btn = QPushButton('Перейти', self)
+        self.go_btn.clicked.connect(self.go_clicked)
+        self.seek_layout.addWidget(self.go_btn)
+        self.main_layout.addLayout(self.seek_layout)
+
+        self.play_layout = QHBoxLayout()
+        self.prev_event_btn = QPushButton('<< Событие', self)
+        self.prev_event_btn.clicked.connect(self.prev_event)
+        self.play_layout.addWidget(self.prev_event_btn)
+        self.play_btn = QPushButton('Воспроизвести', self)
+        self.play_btn.clicked.connect(self.toggle_play)
+        self.play_layout.addWidget(self.play_btn)
+        self.next_event_btn = QPushButton('Событие >>', self)
+        self.next_event_btn.clicked.connect(self.next_event)
+        self.play_layout.addWidget(self.next_event_btn)
+        self.main_layout.addLayout(self.play_layout)
+
+    def go_clicked(self, event):
+        self.seek(self.datetime_edit.dateTime().toMSecsSinceEpoch() / 1000)
+
+    def seek(self, ts):
+        self.position = self.store.seek(ts)
+        if not self.show_current():
+            self.stop_playing()
+            self.video_label.setText('Нет записей после ' +
+                                     datetime.fromtimestamp(ts).strftime('%d.%m.%y %H:%M:%S'))
+
+    # Показывает кадр в текущей позиции, False - кадра нет
+    def show_current(self):
+        if self.position is None:
+            return False
+        record = self.store.read_frame(*self.position)
+        if record is None:
+            return False
+        ts, jpeg, flags = record
+        frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return False
+        self.current_ts = ts
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        image = QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0],
+                       QImage.Format_RGB888)
+        pixmap = QPixmap.fromImage(image).scaled(self.video_label.size(), Qt.KeepAspectRatio)
+        self.video_label.setPixmap(pixmap)
+        self.time_label.setText(datetime.fromtimestamp(ts).strftime('%d.%m.%y %H:%M:%S'))
+        return True
+
+    def toggle_play(self, event):
+        if self.timer.isActive():
+            self.stop_playing()
+        elif self.position is not None:
+            self.play_btn.setText('Пауза')
+            self.timer.start(0)
+
+    def stop_playing(self):
+        self.timer.stop()
+        self.play_btn.setText('Воспроизвести')
+
+    def play_next(self):
+        prev_ts = self.current_ts
+        position = self.store.next_position(*self.position)
+        if position is None:
+            self.stop_playing()
+            return
+        self.position = position
+        if not self.show_current():
+            self.stop_playing()
+            return
+        delay_ms = (self.current_ts - prev_ts) * 1000 if prev_ts is not None else 0
+        self.timer.start(int(min(MAX_FRAME_DELAY_MS, max(0, delay_ms))))
+
+    def prev_event(self, event):
+        end = self.current_ts if self.current_ts is not None else time.time()
+        for day in range(EVENT_SEARCH_DAYS):
+            events = self.store.find_events(end - EVENT_SEARCH_STEP_SEC, end)
+            if len(events) > 0:
+                self.seek(events[-1])
+                return
+            end -= EVENT_SEARCH_STEP_SEC
+
+    def next_event(self, event):
+        if self.current_ts is None:
+            return
+        start = self.current_ts + 0.001
+        for day in range(EVENT_SEARCH_DAYS):
+            events = self.store.find_events(start, start + EVENT_SEARCH_STEP_SEC)
+            if len(events) > 0:
+                self.seek(events[0])
+                return
+            start += EVENT_SEARCH_STEP_SEC
+
+    def closeEvent(self, event):
+        self.stop_playing()
+        event.accept()
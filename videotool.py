@@ -1,9 +1,30 @@
+import time
+from threading import Lock
+
 import cv2
 import numpy as np
 
 import cameramode
+import metrics
+from eventstore import KIND_DETECTION, KIND_ZONE_ENTRY
 
 PROCESS_PERIOD = 5  # период обновления информации детекторами
+TRACKED_PROCESS_PERIOD = 15  # период для обнаружения объектов, если между
+                             # запусками детектора рамки ведёт трекер
+MOTION_GATE_AREA = 0.005  # доля площади кадра, начиная с которой движение
+                          # считается достаточным для запуска поиска объектов
+MOTION_GATE_MARGIN = 20  # отступ вокруг областей движения, пикселей
+ROI_MARGIN = 30  # отступ вокруг охраняемой зоны при поиске объектов только в ней
+ANALYSIS_WIDTH = 640  # ширина кадра анализа, высота - по пропорциям потока
+# цвета в RGB
+COLOR_PEOPLE = (104, 176, 77)
+COLOR_OBJECTS = (0, 255, 100)
+COLOR_MOTION = (225, 252, 49)
+COLOR_BORDERS = (227, 28, 33)
+
+
+def frame_size(frame):
+    return frame.shape[1], frame.shape[0]
 
 
 class VideoTool:
@@ -14,71 +35,361 @@ class VideoTool:
             y = rectangle[1] - 15 if rectangle[1] - 15 > 15 else rectangle[1] + 15
             cv2.putText(frame, label, (rectangle[0], y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
+    # Прямоугольник, охватывающий все rectangles, с отступом margin,
+    # обрезанный по границам кадра width x height
+    @staticmethod
+    def union_rectangle(rectangles, width, height, margin=0):
+        x1 = max(0, min(r[0] for r in rectangles) - margin)
+        y1 = max(0, min(r[1] for r in rectangles) - margin)
+        x2 = min(width, max(r[2] for r in rectangles) + margin)
+        y2 = min(height, max(r[3] for r in rectangles) + margin)
+        return int(x1), int(y1), int(x2), int(y2)
+
+    # Переводит рамки из координат кадра from_size в координаты кадра to_size
+    @staticmethod
+    def scale_boxes(boxes, from_size, to_size):
+        if from_size is None or tuple(from_size) == tuple(to_size) or len(boxes) == 0:
+            return boxes
+        sx = to_size[0] / from_size[0]
+        sy = to_size[1] / from_size[1]
+        return [(int(b[0] * sx), int(b[1] * sy), int(b[2] * sx), int(b[3] * sy)) for b in boxes]
+
     def __init__(self, src, init_fc = 0):
+        self.display_size = None  # размер, в котором кадры сейчас показываются
+        self.analysis_size = None  # (ширина, высота) кадра анализа, None - по ANALYSIS_WIDTH
         self.set_video_source(src)
-        self.color_people = (104, 176, 77)
-        self.color_objects = (0, 255, 100)
-        self.color_motion = (225, 252, 49)
-        self.color_borders = (227, 28, 33)
+        self.set_display_format(is_rgb=True)
         self.thickness_rectangle = 3
         self.thickness_border = 3
         self.frame_counter = init_fc
+        self.process_period = PROCESS_PERIOD
         self.last_gf_func = lambda frame: frame  # последний результат обработки (в виде функции)
+        self.is_result_fresh = False  # last_gf_func обновлена и ещё не отрисована
+        self.last_result = ((), None)  # (рамки, метки) последнего результата
+        self.result_seq = 0  # растёт с каждым новым результатом
+        self.results_lock = Lock()  # анализ и отрисовка могут идти в разных потоках
         self.mode = cameramode.ORIGINAL
         self.object_detector = None
         self.motion_detector = None
         self.border_detector = None
+        self.tracker = None  # ведёт рамки объектов между запусками детектора
+        self.schedule = None  # CameraSchedule из DetectionScheduler, заменяет process_period
         self.is_playing = True
         self.is_borders_mode = False
+        self.motion_gate_area = MOTION_GATE_AREA
+        self.motion_gate_margin = MOTION_GATE_MARGIN
+        self.is_roi_inference = False  # искать объекты только вокруг охраняемой зоны
+        self.roi_margin = ROI_MARGIN
+        self.zone_min_overlap = None  # None - в зоне, если в ней центр рамки,
+                                      # иначе - минимальная доля площади рамки в зоне
+        self.recorder = None  # EventRecorder, запускается движением или объектом в зоне
+        self.event_store = None  # EventStore, журнал новых объектов и входов в зону
+        self.camera_id = 0  # номер камеры в журнале
+        self.timers = metrics.StageTimers()  # время этапов, CameraFactory подключает их к метрикам
+        self.logged_tracks = set()  # треки, о которых уже есть запись в журнале
+        self.tracks_in_zone = set()  # треки, которые сейчас в охраняемой зоне
         print('VideoTool created:', self.fps, 'FPS')
 
+    # src = None - поток читает кто-то другой (общий CaptureHub или процесс камеры),
+    # параметры кадров тогда задаются через set_sources или set_stream_info
     def set_video_source(self, src):
+        self.source = None  # SharedCapture основного потока
+        self.sub_source = None  # SharedCapture дополнительного потока
+        self.video = None
+        if src is None:
+            self.set_stream_info(0, 0, 0)
+            return
         self.video = cv2.VideoCapture(src)
-        self.fps = self.video.get(cv2.CAP_PROP_FPS)
-        self.freq_ms = int(1000 / self.fps)
-        self.frame_w = self.video.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.frame_h = self.video.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        # fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        # self.out = cv2.VideoWriter('output.avi', fourcc, 20.0, (640, 480))
-
-    def get_frame(self, original, width, height, mode=None, bgr_to_rgb=True):
+        self.set_stream_info(self.video.get(cv2.CAP_PROP_FPS),
+                             self.video.get(cv2.CAP_PROP_FRAME_WIDTH),
+                             self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    # Потоки из CaptureHub. sub_source - дополнительный поток низкого разрешения
+    # (substream камеры), по нему идёт анализ, основной декодируется только для показа
+    def set_sources(self, source, sub_source=None):
+        self.source = source
+        self.sub_source = sub_source
+        self.set_stream_info(source.fps, source.frame_w, source.frame_h)
+
+    # Кадры для показа в RGB или в BGR (как пришли из потока) - от этого
+    # зависит порядок каналов в цветах рамок
+    def set_display_format(self, is_rgb):
+        order = (lambda color: color) if is_rgb else (lambda color: color[::-1])
+        self.color_people = order(COLOR_PEOPLE)
+        self.color_objects = order(COLOR_OBJECTS)
+        self.color_motion = order(COLOR_MOTION)
+        self.color_borders = order(COLOR_BORDERS)
+
+    def set_stream_info(self, fps, frame_w, frame_h):
+        self.fps = fps
+        self.freq_ms = int(1000 / self.fps) if self.fps > 0 else 0
+        self.frame_w = frame_w
+        self.frame_h = frame_h
+
+    # Размер кадра анализа для потока width x height. Не зависит от размера окна,
+    # поэтому стоимость детекторов и их пороги (min_area и т.п.) постоянны.
+    # Кадр меньше ANALYSIS_WIDTH (например, substream) анализируется как есть
+    def get_analysis_size(self, width, height):
+        if self.analysis_size is not None:
+            return self.analysis_size
+        if width <= ANALYSIS_WIDTH:
+            return int(width), int(height)
+        return ANALYSIS_WIDTH, int(round(height * ANALYSIS_WIDTH / width))
+
+    def has_substream(self):
+        return self.sub_source is not None
+
+    # Основной поток нужно показывать, если нет дополнительного или если
+    # показываемый кадр больше кадра дополнительного потока. Для записи
+    # EventRecorder сам декодирует его только во время события
+    def is_main_stream_needed(self):
+        if self.sub_source is None:
+            return True
+        if self.display_size is None:
+            return False
+        return self.display_size[0] > self.sub_source.frame_w or \
+            self.display_size[1] > self.sub_source.frame_h
+
+    # analyze=False - кадр только отрисовывается с последними результатами,
+    # анализ тогда выполняется отдельно через analyze (например, в своём потоке).
+    # dst - готовый буфер (height, width, 3), в котором собирается кадр
+    def get_frame(self, original, width, height, mode=None, bgr_to_rgb=True, analyze=True, dst=None):
         if original is None:
             retval, original = self.video.read()
-        # TODO: обработать отсутствие кадра
-        assert original is not None, 'Кадр не получен'
+        if original is None:
+            return None  # кадр не получен: поток оборвался, его переподключает CaptureHub
         if mode is None:
             mode = self.mode
 
-        frame = cv2.resize(original, (width, height), interpolation=cv2.INTER_AREA)
+        time_start = time.perf_counter()
+        frame = self.prepare_frame(original, width, height, bgr_to_rgb, dst)
+        time_start = self.timers.observe_since('resize', time_start)
         # bad code
         """if self.border_detector.is_drawing:
             cv2.imshow(self.border_detector.window_id, self.border_detector.draw_regions(frame))"""
-        if bgr_to_rgb:
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        self.frame_counter = (self.frame_counter + 1) % PROCESS_PERIOD
         if mode == cameramode.ORIGINAL:
             return frame
+        if frame is original:
+            frame = original.copy()  # исходный кадр нужен анализу и записи, рисуем на копии
+        if analyze:
+            self.analyze(frame, mode)
+            time_start = time.perf_counter()
+        frame = self.render(frame, mode)
+        self.timers.observe_since('render', time_start)
+        return frame
 
-        if self.frame_counter == 0:
+    def prepare_frame(self, original, width, height, bgr_to_rgb=True, dst=None):
+        frame = original
+        if original.shape[1] != width or original.shape[0] != height:
+            frame = cv2.resize(original, (width, height), dst=dst, interpolation=cv2.INTER_AREA)
+        elif dst is not None:
+            np.copyto(dst, original)
+            frame = dst
+        if bgr_to_rgb:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=dst)
+        return frame
+
+    # Запускает детекторы на кадре и запоминает результат для render
+    def analyze(self, frame, mode=None):
+        if mode is None:
+            mode = self.mode
+        height, width = frame.shape[:2]
+        self.frame_counter = (self.frame_counter + 1) % self.get_process_period(mode)
+        if mode == cameramode.ORIGINAL:
+            return
+
+        is_analysis_frame = self.is_analysis_frame(frame, mode)
+        if mode == cameramode.DETECT_MOTION_OBJECTS:
+            # детектор движения дешёвый и должен видеть каждый кадр,
+            # сеть запускается только если что-то движется
+            time_start = time.perf_counter()
+            motion_boxes = self.motion_detector.process(frame)
+            self.timers.observe_since('motion', time_start)
+            if is_analysis_frame:
+                if self.is_motion_enough(motion_boxes, width, height):
+                    if self.take_detection_token():
+                        region = self.union_rectangle(motion_boxes, width, height,
+                                                      self.motion_gate_margin)
+                        region = self.intersect_with_roi(region, width, height)
+                        self.detect_objects(frame, region)
+                else:
+                    if self.schedule is not None:
+                        self.schedule.skip()
+                    self.clear_detections()
+        elif is_analysis_frame:
             if mode == cameramode.DETECT_OBJECTS:
-                boxes, scores, labels = self.object_detector.process(frame)
-                self.last_gf_func = lambda frame:  \
-                    self.draw_detections(frame, boxes, labels)
+                if self.take_detection_token():
+                    region = self.intersect_with_roi((0, 0, width, height), width, height)
+                    self.detect_objects(frame, region)
             elif mode == cameramode.DETECT_MOTION:
-                boxes = self.motion_detector.process(frame)
-                self.last_gf_func = lambda frame: \
-                    self.draw_detections(frame, boxes)
+                time_start = time.perf_counter()
+                motion_boxes = self.motion_detector.process(frame)
+                self.timers.observe_since('motion', time_start)
+                self.set_motion_detections(motion_boxes, (width, height))
+            else:
+                self.clear_detections()
+
+    # Рисует на кадре последний результат анализа. Между анализами
+    # рамки объектов двигает трекер
+    def render(self, frame, mode=None):
+        if mode is None:
+            mode = self.mode
+        with self.results_lock:
+            if self.is_result_fresh:
+                self.is_result_fresh = False
+            elif self.tracker is not None and \
+                    (mode == cameramode.DETECT_OBJECTS or mode == cameramode.DETECT_MOTION_OBJECTS):
+                self.tracker.predict()
+            return self.last_gf_func(frame)
+
+    # Вызывается под results_lock. boxes и labels - сам результат
+    # (labels = None для областей движения), func - его отрисовка
+    def set_gf_func(self, func, boxes=(), labels=None):
+        self.last_gf_func = func
+        self.last_result = (boxes, labels)
+        self.result_seq += 1
+        self.is_result_fresh = True
+
+    # process_period относится к поиску объектов, движение проверяется как раньше
+    def get_process_period(self, mode):
+        if mode == cameramode.DETECT_OBJECTS or mode == cameramode.DETECT_MOTION_OBJECTS:
+            return self.process_period
+        return PROCESS_PERIOD
+
+    def is_analysis_frame(self, frame, mode):
+        if self.schedule is not None and \
+                (mode == cameramode.DETECT_OBJECTS or mode == cameramode.DETECT_MOTION_OBJECTS):
+            return self.schedule.is_due(frame)
+        return self.frame_counter == 0
+
+    # Токен общего бюджета запусков детектора - непосредственно перед запуском
+    def take_detection_token(self):
+        return self.schedule is None or self.schedule.take_token()
+
+    def detect_objects(self, frame, region):
+        time_start = time.perf_counter()
+        boxes, scores, labels = self.object_detector.process_region(frame, region)
+        self.timers.observe_since('objects', time_start)
+        if self.schedule is not None:
+            # в бюджет идёт доля этого кадра во времени пакетного sess.run,
+            # а не ожидание пакета и чужие кадры в нём
+            self.schedule.report_detections(len(boxes), self.object_detector.last_inference_sec)
+        self.set_object_detections(boxes, labels, (frame.shape[1], frame.shape[0]), scores)
+
+    # size - (width, height) кадра, на котором найдены рамки; при отрисовке
+    # они переводятся в координаты показываемого кадра
+    def set_object_detections(self, boxes, labels, size=None, scores=None):
+        with self.results_lock:
+            # зона проверяется здесь, под results_lock, а не в report_event
+            in_zone = self.get_in_zone(boxes, size)
+            if self.tracker is None:
+                self.set_gf_func(lambda frame: self.draw_detections(
+                                     frame, self.scale_boxes(boxes, size, frame_size(frame)), labels,
+                                     in_zone=in_zone),
+                                 boxes, labels)
             else:
-                self.last_gf_func = lambda frame: frame
-        return self.last_gf_func(frame)
+                self.tracker.update(boxes, labels, scores)
+                tracks = list(self.tracker.tracks)
+                track_boxes = [tuple(int(v) for v in t.box) for t in tracks]
+                track_in_zone = self.get_in_zone(track_boxes, size)
+                zones = None if track_in_zone is None else \
+                    {t.track_id: bool(z) for t, z in zip(tracks, track_in_zone)}
+                self.set_gf_func(lambda frame: self.draw_tracks(frame, size, zones),
+                                 boxes, labels)
+                self.log_tracks(size, tracks, track_boxes, track_in_zone)
+        self.report_event(boxes, in_zone)
+
+    # Флаги "рамка в охраняемой зоне" для рамок в координатах кадра size.
+    # Считаются один раз на кадре анализа, отрисовка только выбирает по ним цвет.
+    # None - зона не задана
+    def get_in_zone(self, boxes, size):
+        if not self.is_borders_mode or size is None:
+            return None
+        return self.border_detector.are_rectangles_in_regions(boxes, size, self.zone_min_overlap)
+
+    # Пишет в журнал появление новых объектов и их входы в охраняемую зону.
+    # Объекты различаются по трекам, поэтому один и тот же объект
+    # не попадает в журнал на каждом запуске детектора
+    def log_tracks(self, size, tracks, boxes, in_zone):
+        if self.event_store is None:
+            return
+        if in_zone is None:
+            in_zone = [False] * len(tracks)
+        tracks_in_zone = set()
+        for track, box, is_in_zone in zip(tracks, boxes, in_zone):
+            if track.frames_since_update > 0:
+                continue
+            if track.track_id not in self.logged_tracks:
+                self.event_store.add(KIND_DETECTION, self.camera_id, track.label, track.score,
+                                     box, size)
+            if is_in_zone:
+                tracks_in_zone.add(track.track_id)
+                if track.track_id not in self.tracks_in_zone:
+                    self.event_store.add(KIND_ZONE_ENTRY, self.camera_id, track.label, track.score,
+                                         box, size)
+        alive = {t.track_id for t in self.tracker.tracks}
+        self.logged_tracks = alive
+        # трек, пропущенный детектором, из зоны пока не вышел
+        self.tracks_in_zone = tracks_in_zone | \
+            {t.track_id for t in self.tracker.tracks if t.frames_since_update > 0} & self.tracks_in_zone
+
+    def set_motion_detections(self, boxes, size=None):
+        with self.results_lock:
+            in_zone = self.get_in_zone(boxes, size)
+            self.set_gf_func(lambda frame: self.draw_detections(
+                                 frame, self.scale_boxes(boxes, size, frame_size(frame)), in_zone=in_zone),
+                             boxes)
+        self.report_event(boxes)
+
+    # Событие для записи: движение или объект в охраняемой зоне
+    # (если зона не задана - в любом месте кадра). in_zone - флаги рамок,
+    # посчитанные под results_lock, детектор зоны здесь не вызывается
+    def report_event(self, boxes, in_zone=None):
+        if self.recorder is None or len(boxes) == 0:
+            return
+        if in_zone is not None and not np.any(in_zone):
+            return
+        self.recorder.trigger()
+
+    # zones - {номер трека: в зоне ли он} на последнем кадре анализа
+    def draw_tracks(self, frame, size, zones=None):
+        boxes, labels, ids = self.tracker.get_tracks()
+        in_zone = None if zones is None else [zones.get(track_id, False) for track_id in ids]
+        return self.draw_detections(frame, self.scale_boxes(boxes, size, frame_size(frame)),
+                                    labels, ids, in_zone)
 
-    def draw_detections(self, frame, boxes, labels=None):
+    def clear_detections(self):
+        with self.results_lock:
+            if self.tracker is not None:
+                self.tracker.clear()
+            self.set_gf_func(lambda frame: frame)
+
+    # Сужает region до окрестности охраняемой зоны, если включён is_roi_inference
+    def intersect_with_roi(self, region, width, height):
+        if not (self.is_roi_inference and self.is_borders_mode):
+            return region
+        roi = self.border_detector.bounding_rect(width, height, self.roi_margin)
+        return (max(region[0], roi[0]), max(region[1], roi[1]),
+                min(region[2], roi[2]), min(region[3], roi[3]))
+
+    def is_motion_enough(self, motion_boxes, width, height):
+        if len(motion_boxes) == 0:
+            return False
+        motion_area = sum((r[2] - r[0]) * (r[3] - r[1]) for r in motion_boxes)
+        return motion_area >= self.motion_gate_area * width * height
+
+    # in_zone - флаги рамок, посчитанные на кадре анализа (get_in_zone)
+    def draw_detections(self, frame, boxes, labels=None, ids=None, in_zone=None):
         count = len(boxes)
         if labels is None:
             labels = [None] * count
+        captions = labels
+        if ids is not None:
+            captions = ['{} #{}'.format(labels[i], ids[i]) for i in range(count)]
 
         colors = []
-        if self.mode == cameramode.DETECT_OBJECTS:
+        if self.mode == cameramode.DETECT_OBJECTS or \
+                self.mode == cameramode.DETECT_MOTION_OBJECTS:
             for i in range(count):
                 if labels[i] == self.object_detector.labels[1 - 1]:  # если человек
                     colors.append(self.color_people)
@@ -91,13 +402,13 @@ class VideoTool:
 
         if self.is_borders_mode:
             frame = self.border_detector.draw_regions(frame, self.color_borders, self.thickness_border)
-            are_rects_in_regs = self.border_detector.are_rectangles_in_regions(list(boxes))
-            for i in range(count):
-                if are_rects_in_regs[i]:
-                    colors[i] = self.color_borders
+            if in_zone is not None:
+                for i in range(count):
+                    if in_zone[i]:
+                        colors[i] = self.color_borders
 
         for i in range(count):
-            self.draw_rectangle(frame, boxes[i], colors[i], self.thickness_rectangle, labels[i])
+            self.draw_rectangle(frame, boxes[i], colors[i], self.thickness_rectangle, captions[i])
         return frame
 
     def get_security_detected(self, width=500, img=None):
@@ -106,13 +417,8 @@ class VideoTool:
     def is_displayable(self):
         return self.mode == cameramode.ORIGINAL or \
                self.mode == cameramode.DETECT_OBJECTS or \
-               self.mode == cameramode.DETECT_MOTION
-
-    # def video_rec(self):
-    #     while cap.isOpened():
-    #         ret, frame = cap.read()
-    #         if ret:
-    #             out.write(frame)
+               self.mode == cameramode.DETECT_MOTION or \
+               self.mode == cameramode.DETECT_MOTION_OBJECTS
 
     def play(self):
         self.is_playing = True
@@ -121,8 +427,13 @@ class VideoTool:
         self.is_playing = False
 
     def close(self):
-        self.video.release()
+        # потоки из CaptureHub закрывает он сам
+        if self.video is not None:
+            self.video.release()
 
     def set_mode(self, mode):
         self.mode = mode
+        with self.results_lock:
+            if self.tracker is not None:
+                self.tracker.clear()
         print('Mode is', self.mode)
@@ -1,8 +1,15 @@
+from threading import Lock
+
+import numpy as np
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
 import cameramode
+from capturehub import STATE_CONNECTING, STATE_LIVE, STATE_RECONNECTING
+
+COLOR_OVERLAY = '#80FF80'  # текст метрик поверх видео
+
 
 class ToolbarButton(QPushButton):
     def __init__(self, parent):
@@ -22,11 +29,100 @@ class ToolbarComboBox(QComboBox):
         self.setSizePolicy(sp)
 
 
+# Рисует кадры, которые поток камеры публикует через publish. Два буфера
+# с QImage над каждым: в заднем (get_buffer) поток камеры собирает кадр,
+# publish меняет буферы местами, передний рисуется в paintEvent в потоке
+# интерфейса. Буферы пересоздаются только при смене размера. Кадры BGR
+# рисуются как есть, если Qt (5.14+) умеет Format_BGR888, иначе их надо
+# заранее перевести в RGB
+class FrameCanvas(QWidget):
+    needs_rgb = not hasattr(QImage, 'Format_BGR888')
+    image_format = QImage.Format_RGB888 if needs_rgb else QImage.Format_BGR888
+    frame_ready = pyqtSignal()
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)  # фон закрашивается в paintEvent
+        self.lock = Lock()
+        self.front = None  # (массив, QImage над ним) - рисуется
+        self.back = None  # то же - заполняется потоком камеры
+        self.is_update_pending = False
+        self.size_wh = (0, 0)  # размер виджета для потоков камер
+        self.overlay_text = None  # метрики поверх кадра, см. UI.update_overlays
+        self.frame_ready.connect(self.update)
+
+    def create_buffer(self, shape):
+        buffer = np.empty(shape, dtype=np.uint8)
+        return buffer, QImage(buffer.data, shape[1], shape[0], buffer.strides[0], self.image_format)
+
+    # Задний буфер для следующего кадра. get_buffer и publish вызываются
+    # из одного потока камеры; передний буфер он при этом не трогает
+    def get_buffer(self, shape):
+        back = self.back
+        if back is None or back[0].shape != shape:
+            back = self.create_buffer(shape)
+            self.back = back
+        return back[0]
+
+    # Кадр, собранный не в get_buffer, сначала копируется в задний буфер
+    def publish(self, frame):
+        buffer = self.get_buffer(frame.shape)
+        if frame is not buffer:
+            np.copyto(buffer, frame)
+        with self.lock:
+            if self.back is not None and self.back[0] is buffer:
+                self.front, self.back = self.back, self.front
+            is_update_pending = self.is_update_pending
+            self.is_update_pending = True
+        # пока предыдущий кадр не нарисован, новый просто заменяет его в буфере
+        if not is_update_pending:
+            self.frame_ready.emit()
+
+    def clear(self):
+        with self.lock:
+            self.front = None
+            self.back = None
+        self.update()
+
+    def get_size(self):
+        return self.size_wh
+
+    def resizeEvent(self, event):
+        self.size_wh = (self.width(), self.height())
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        with self.lock:
+            self.is_update_pending = False
+            if self.front is not None:
+                image = self.front[1]
+                painter.drawImage((self.width() - image.width()) // 2,
+                                  (self.height() - image.height()) // 2, image)
+        if self.overlay_text is not None:
+            rect = painter.boundingRect(self.rect().adjusted(4, 4, -4, -4),
+                                        Qt.AlignLeft | Qt.AlignTop | Qt.TextWordWrap, self.overlay_text)
+            painter.fillRect(rect.adjusted(-2, -2, 2, 2), QColor(0, 0, 0, 160))
+            painter.setPen(QColor(COLOR_OVERLAY))
+            painter.drawText(rect, Qt.AlignLeft | Qt.AlignTop | Qt.TextWordWrap, self.overlay_text)
+        painter.end()
+
+
 class VideoView(QWidget):
     """caption_font = QFont()
     caption_font.setFamily('Arial')
     caption_font.setPointSize(20)"""
     layout_spacing = 4
+    caption_style = 'font-size: 16pt "MS Shell Dlg 2";\ncolor: {};'
+    state_texts = {STATE_CONNECTING: ' - подключение...',
+                   STATE_LIVE: '',
+                   STATE_RECONNECTING: ' - переподключение...'}
+    state_colors = {STATE_CONNECTING: '#F0F8FD',
+                    STATE_LIVE: '#F0F8FD',
+                    STATE_RECONNECTING: '#FFB040'}
+    # Состояние источника камеры, можно испускать из любого потока
+    state_changed = pyqtSignal(int)
 
     def __init__(self, parent, **kwargs):
         QWidget.__init__(self, parent)
@@ -39,8 +135,9 @@ class VideoView(QWidget):
         self.main_vbox.setSpacing(self.layout_spacing)
         self.caption_label = QLabel(self)
         # self.caption_label.setFont(self.caption_font)
-        self.caption_label.setStyleSheet('font-size: 16pt "MS Shell Dlg 2";\ncolor: #F0F8FD;')
+        self.caption_label.setStyleSheet(self.caption_style.format(self.state_colors[STATE_LIVE]))
         self.caption_label.setText(self.caption)
+        self.state_changed.connect(self.show_state)
         self.main_vbox.addWidget(self.caption_label)
         self.video_label_container = QWidget(self)
         self.video_label_container.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
@@ -49,12 +146,9 @@ class VideoView(QWidget):
         self.video_label_container_layout = QHBoxLayout(self.video_label_container)
         self.video_label_container_layout.setAlignment(Qt.AlignCenter)
         self.video_label_container_layout.setContentsMargins(0, 0, 0, 0)
-        self.video_label = QLabel(self.video_label_container)
-        # self.video_label.setStyleSheet('background-image: url(:/everything/resources/Black_bk.jpg);'')
-        self.video_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        self.video_label.setAlignment(Qt.AlignCenter)
-        # self.video_label.setStyleSheet('background: red;')
-        self.video_label_container_layout.addWidget(self.video_label)
+        self.video_canvas = FrameCanvas(self.video_label_container)
+        self.video_canvas.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.video_label_container_layout.addWidget(self.video_canvas)
         self.main_vbox.addWidget(self.video_label_container)
         self.toolbar_hbox_w = QWidget(self)
         self.toolbar_hbox_w.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
@@ -64,10 +158,11 @@ class VideoView(QWidget):
         self.toolbar_hbox.setSpacing(self.layout_spacing)
         self.toolbar_hbox.setContentsMargins(0, 0, 0, 0)
         self.mode_cb = ToolbarComboBox(self)
-        for i in range(3): self.mode_cb.addItem('NONAME')
+        for i in range(4): self.mode_cb.addItem('NONAME')
         self.mode_cb.setItemText(cameramode.ORIGINAL, 'Оригинальный видеопоток')
         self.mode_cb.setItemText(cameramode.DETECT_OBJECTS, 'Обнаружение объектов')
         self.mode_cb.setItemText(cameramode.DETECT_MOTION, 'Обнаружение движения')
+        self.mode_cb.setItemText(cameramode.DETECT_MOTION_OBJECTS, 'Обнаружение объектов в движении')
         # self.mode_cb.setItemText(cameramode.DETECT_BORDERS, 'Обнаружение пересечения границ')
         self.toolbar_hbox.addWidget(self.mode_cb)
         self.borders_btn = ToolbarButton(self)
@@ -79,3 +174,12 @@ class VideoView(QWidget):
         self.main_vbox.addWidget(self.toolbar_hbox_w)
 
         self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+    # Вызывается из потока интерфейса
+    def set_overlay_text(self, text):
+        self.video_canvas.overlay_text = text
+        self.video_canvas.update()
+
+    def show_state(self, state):
+        self.caption_label.setText(self.caption + self.state_texts[state])
+        self.caption_label.setStyleSheet(self.caption_style.format(self.state_colors[state]))
@@ -0,0 +1,311 @@
+import os
+import time
+import traceback
+from datetime import datetime
+from threading import Thread, Lock
+
+import cameramode
+import metrics
+from config import load_labels, MODES
+from videotool import VideoTool, TRACKED_PROCESS_PERIOD
+from capturehub import POLICY_QUEUE, STATE_LIVE, STATE_RECONNECTING, combined_state
+from detectionscheduler import DetectionScheduler
+from eventstore import KIND_GUARD, KIND_CAMERA_FAULT
+from recorder import EventRecorder
+from recordstore import RecordStore
+from frame_analysis.object_detector import ObjectDetector
+from frame_analysis.border_detector import BorderDetector
+from frame_analysis.motion_detector import MotionDetector
+from frame_analysis.inference_scheduler import InferenceScheduler
+from frame_analysis.model_registry import ModelRegistry
+from frame_analysis.tracker import IouTracker
+
+# Потоки обработки, не зависящие от Qt: их запускает и окно (main.py),
+# и режим без интерфейса (headless.py)
+
+FRAME_WAIT_SEC = 0.1  # как часто потоки проверяют stop_event, пока нет новых кадров
+SECURITY_CAMERA_ID = 4  # охрана смотрит в тот же источник, что и камера №4
+
+
+# Анализ кадров одной камеры в своём темпе: медленный детектор
+# не задерживает показ, VideoWorker рисует последний готовый результат
+class AnalysisWorker(Thread):
+    # count_stats=True - ячейка только для анализа, и её счётчики (потери кадров
+    # в метриках) ведёт он, иначе их ведёт показ из той же ячейки
+    def __init__(self, name, videotool, frame_slot, analysis_fps, stop_event, count_stats=False):
+        super().__init__(name=name)
+        self.vtool = videotool
+        self.frame_slot = frame_slot
+        self.count_stats = count_stats
+        self.analysis_period = 1 / analysis_fps
+        self.stop_event = stop_event
+
+    def run(self):
+        last_seq = 0
+        next_time = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                delay = next_time - time.monotonic()
+                if delay > 0 and self.stop_event.wait(delay):
+                    break
+                seq, original = self.frame_slot.get(last_seq, timeout=FRAME_WAIT_SEC,
+                                                    count_stats=self.count_stats)
+                if original is None:
+                    if self.frame_slot.is_closed:
+                        break
+                    continue
+                last_seq = seq
+                next_time = time.monotonic() + self.analysis_period
+
+                mode = self.vtool.mode
+                if mode == cameramode.ORIGINAL or \
+                        not self.vtool.is_playing or self.vtool.border_detector.is_drawing:
+                    continue
+                # размер анализа не зависит от окна,
+                # рамки переводятся в координаты показа при отрисовке
+                time_start = time.perf_counter()
+                size = self.vtool.get_analysis_size(original.shape[1], original.shape[0])
+                frame = self.vtool.prepare_frame(original, size[0], size[1])
+                time_start = self.vtool.timers.observe_since('analysis_resize', time_start)
+                self.vtool.analyze(frame, mode)
+                self.vtool.timers.observe_since('analyze', time_start)
+            print('It\'s {}, goodbye!'.format(self.getName()))
+        except:
+            print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
+
+
+class SecurityDetectorWorker(Thread):
+    def __init__(self, name, source, object_detector,
+                 checking_period_sec, checking_burst, mutex, stop_event,
+                 event_store=None, camera_id=SECURITY_CAMERA_ID):
+        super().__init__(name=name)
+        self.source = source  # SharedCapture из CaptureHub
+        self.object_detector = object_detector
+        self.event_store = event_store
+        self.camera_id = camera_id
+        self.checking_period_sec = checking_period_sec
+        self.checking_burst = checking_burst
+        self.mutex = mutex
+        self.stop_event = stop_event
+
+        self.security_prev_state = False
+        self.security_curr_state = False
+        self.frames = None
+        self.timers = metrics.REGISTRY.stage_timers(camera=camera_id)
+    
+    def run(self):
+        # кадры декодируются только по запросу на время проверки
+        self.frames = self.source.subscribe(policy=POLICY_QUEUE, maxlen=self.checking_burst,
+                                            active=False, name=self.getName())
+        try:
+            self.tick()
+            while not self.stop_event.wait(self.checking_period_sec):
+                time_start = time.perf_counter()
+                self.mutex.acquire()
+                time_start = self.timers.observe_since('security_lock_wait', time_start)
+                if not self.stop_event.is_set():
+                    self.tick()
+                    self.timers.observe_since('security_tick', time_start)
+                self.mutex.release()
+            print('It\'s {}, goodbye!'.format(self.getName()))
+        except:
+            print('{} - unexpected error: {}'.format(self.getName(), traceback.format_exc()))
+            if self.mutex.locked():
+                self.mutex.release()
+        finally:
+            self.source.unsubscribe(self.frames)
+
+    # Действия, которые выполняются над каждым кадром
+    def tick(self):
+        print('Let\'s check...')
+        self.security_prev_state = self.security_curr_state
+        self.security_curr_state = False
+        log_str = ''
+        self.frames.clear()
+        self.source.request(self.frames, self.checking_burst)
+        try:
+            for i in range(self.checking_burst):
+                if self.stop_event.is_set():
+                    return
+                frame = None
+                time_start = time.perf_counter()
+                while frame is None and not self.stop_event.is_set() and not self.frames.is_closed:
+                    frame = self.frames.get(0, timeout=FRAME_WAIT_SEC)[1]
+                if frame is None:
+                    return
+                time_start = self.timers.observe_since('security_frame_wait', time_start)
+                boxes, scores, classes = self.object_detector.process(frame)
+                self.timers.observe_since('security_detect', time_start)
+                if len(boxes) > 0:
+                    self.security_curr_state = True
+                    break
+        finally:
+            self.source.request(self.frames, 0)
+
+        if self.security_curr_state != self.security_prev_state:
+            log_str = '{} - охранник {}'.format(datetime.now().\
+                    strftime('%d.%m.%y %H:%M'),\
+                    'на месте' if self.security_curr_state else 'отсутствует')
+
+        print('Log:', log_str)
+        if log_str != '' and self.event_store is not None:
+            self.event_store.add(KIND_GUARD, self.camera_id, 'person',
+                                 message='на месте' if self.security_curr_state else 'отсутствует')
+
+    def start(self):
+        print('Hello, I\'m {}'.format(self.getName()))
+        super().start()
+
+
+# Пропадание и восстановление видеопотоков - в журнал. update можно
+# вызывать из любого потока (слушатели состояния SharedCapture, сигналы Qt)
+class CameraStateLog:
+    def __init__(self, event_store):
+        self.event_store = event_store
+        self.states = {}  # последнее состояние видеопотока каждой камеры
+        self.lock = Lock()
+
+    def update(self, camera_id, state):
+        with self.lock:
+            prev_state = self.states.get(camera_id)
+            self.states[camera_id] = state
+        if state == STATE_RECONNECTING and prev_state != STATE_RECONNECTING:
+            self.event_store.add(KIND_CAMERA_FAULT, camera_id, message='видеопоток потерян')
+        elif state == STATE_LIVE and prev_state == STATE_RECONNECTING:
+            self.event_store.add(KIND_CAMERA_FAULT, camera_id, message='видеопоток восстановлен')
+
+
+# Общие для всех камер ресурсы (модель, планировщики инференса, CaptureHub,
+# журнал) и сборка VideoTool камеры по её настройкам (см. config.CAMERA_DEFAULTS).
+# Камеры можно создавать и освобождать по одной, не трогая остальные
+class CameraFactory:
+    def __init__(self, config, capture_hub, event_store):
+        self.config = config
+        self.capture_hub = capture_hub
+        self.event_store = event_store
+        self.labels = load_labels(config['labels_path'])
+        self.state_listeners = {}  # VideoTool -> [(источник, слушатель)]
+
+        self.model_registry = ModelRegistry(intra_op_threads=config['tf_intra_op_threads'],
+                                            inter_op_threads=config['tf_inter_op_threads'])
+        # Общий пакетный инференс для всех камер и детектора охраны
+        self.inference_scheduler = InferenceScheduler(model=self.model_registry.acquire(config['model_path']),
+                                                      max_batch_size=self.get_max_batch_size(),
+                                                      max_wait_ms=config['inference_max_wait_ms'])
+        # Частоту анализа каждой камеры задаёт её активность в пределах общего бюджета
+        self.detection_scheduler = DetectionScheduler(max_inferences_per_sec=config['detection_max_per_sec'],
+                                                      cpu_budget=config['detection_cpu_budget'])
+        metrics.REGISTRY.add_collector(self.collect)
+
+    def start(self):
+        self.inference_scheduler.start()
+
+    # Кадры всех работающих камер и охраны в одном sess.run,
+    # если размер пакета не задан в конфигурации
+    def get_max_batch_size(self):
+        if self.config['inference_max_batch'] is not None:
+            return self.config['inference_max_batch']
+        return len(self.state_listeners) + 1
+
+    def create_object_detector(self, classes_to_detect, confidence_level):
+        return ObjectDetector(model=self.model_registry.acquire(self.config['model_path']),
+                              labels=self.labels,
+                              classes_to_detect=classes_to_detect,
+                              confidence_level=confidence_level,
+                              scheduler=self.inference_scheduler)
+
+    # use_sources=False - поток камеры читает её процесс (см. cameraprocess),
+    # кадры для записи тогда передаются через recorder.put.
+    # on_state(state) вызывается при каждом изменении состояния потоков камеры
+    def create_videotool(self, camera, use_sources=True, on_state=None):
+        camera_id = camera['id']
+        vtool = VideoTool(src=None, init_fc=camera_id)
+        if use_sources:
+            if camera['substream'] is not None and not camera['record']:
+                # основной поток не нужен ни анализу, ни записи - его не открываем
+                vtool.set_sources(self.capture_hub.get_source(camera['substream']))
+            else:
+                sub_source = None
+                if camera['substream'] is not None:
+                    sub_source = self.capture_hub.get_source(camera['substream'])
+                vtool.set_sources(self.capture_hub.get_source(camera['source']), sub_source)
+
+        vtool.object_detector = self.create_object_detector(camera['classes_to_detect'],
+                                                            camera['confidence_level'])
+        vtool.motion_detector = MotionDetector()
+        vtool.border_detector = BorderDetector()
+        if camera['zone'] is not None:
+            vtool.border_detector.set_points(camera['zone'], camera['zone_size'])
+            vtool.is_borders_mode = True
+        vtool.zone_min_overlap = camera['zone_min_overlap']
+        vtool.is_roi_inference = camera['roi_inference']
+        vtool.analysis_size = camera['analysis_size']
+        vtool.tracker = IouTracker()
+        vtool.process_period = TRACKED_PROCESS_PERIOD
+        vtool.schedule = self.detection_scheduler.register(camera['name'])
+        vtool.event_store = self.event_store
+        vtool.camera_id = camera_id
+        vtool.timers = metrics.REGISTRY.stage_timers(camera=camera_id)
+        vtool.set_mode(MODES[camera['mode']])
+
+        if camera['record']:
+            record = self.config['record']
+            store = RecordStore(os.path.join(self.config['recordings_dir'], 'camera' + str(camera_id)),
+                                segment_sec=record['segment_sec'],
+                                quota_bytes=record['quota_gb'] * 1024 ** 3)
+            vtool.recorder = EventRecorder('Recorder' + str(camera_id), store,
+                                           preroll_sec=record['preroll_sec'],
+                                           max_preroll_bytes=record['preroll_max_mb'] * 1024 * 1024,
+                                           tail_sec=record['tail_sec'],
+                                           record_fps=record['fps'])
+            if use_sources:
+                # пишется основной поток, предзапись - из дополнительного
+                vtool.recorder.set_source(vtool.source, vtool.sub_source)
+
+        self.state_listeners[vtool] = []
+        self.inference_scheduler.set_max_batch_size(self.get_max_batch_size())
+        if use_sources and on_state is not None:
+            sources = (vtool.source, vtool.sub_source)
+
+            def report_state(state, sources=sources):
+                on_state(combined_state(sources))
+
+            for source in sources:
+                if source is not None:
+                    source.add_state_listener(report_state)
+                    self.state_listeners[vtool].append((source, report_state))
+            report_state(None)
+        return vtool
+
+    # Останавливает запись камеры, освобождает её детекторы и закрывает
+    # её потоки, если их больше никто не читает. Вызывается после остановки
+    # потоков, читающих кадры камеры
+    def release_videotool(self, vtool):
+        if vtool.recorder is not None:
+            vtool.recorder.stop()
+        for source, func in self.state_listeners.pop(vtool, []):
+            source.remove_state_listener(func)
+        self.inference_scheduler.set_max_batch_size(self.get_max_batch_size())
+        vtool.object_detector.close()
+        self.detection_scheduler.unregister(vtool.schedule)
+        vtool.close()
+        for source in (vtool.source, vtool.sub_source):
+            if source is not None:
+                self.capture_hub.release(source)
+
+    # Счётчики общего инференса для metrics.REGISTRY
+    def collect(self):
+        stats = self.inference_scheduler.get_stats()
+        return [('inference_batches_total', 'counter', 'Batched sess.run calls', {}, stats['batches']),
+                ('inference_frames_total', 'counter', 'Frames in all batches', {}, stats['frames']),
+                ('inference_busy_seconds_total', 'counter', 'Time spent in batched sess.run', {},
+                 stats['busy_sec']),
+                ('inference_pending_frames', 'gauge', 'Frames waiting for the batched inference', {},
+                 stats['pending']),
+                ('event_queue_length', 'gauge', 'Events waiting to be written to the journal', {},
+                 self.event_store.queue.qsize())]
+
+    def close(self):
+        metrics.REGISTRY.remove_collector(self.collect)
+        self.inference_scheduler.close()
+        self.model_registry.close()